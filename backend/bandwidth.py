@@ -0,0 +1,172 @@
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+
+class TokenBucket:
+    """
+    Token bucket in bytes. Takers may overdraw it; the debt is repaid by
+    waiting, so chunks larger than the burst still pass at the set rate.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate: int = 0):
+        self.rate = 0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.configure(rate)
+        self.tokens = float(self.rate)
+
+    def configure(self, rate: int):
+        self._refill()
+        self.rate = max(0, rate)
+        # Allow up to one second of burst
+        self.tokens = min(self.tokens, float(self.rate)) if self.rate else 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(float(self.rate), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, size: int) -> float:
+        """Take size bytes and return how long the taker should wait, in seconds."""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        self.tokens -= size
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class RateMeter:
+    """Measured throughput over roughly the last second."""
+
+    WINDOW = 1.0
+
+    def __init__(self):
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.rate = 0.0
+
+    def add(self, size: int):
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed >= self.WINDOW:
+            self.rate = self.window_bytes / elapsed
+            self.window_start = now
+            self.window_bytes = 0
+        self.window_bytes += size
+
+    def current(self) -> float:
+        # No bytes for a while means the transfer stalled or finished
+        if time.monotonic() - self.window_start > 2 * self.WINDOW:
+            return 0.0
+        return self.rate
+
+
+class BandwidthShaper:
+    """
+    Rate limits Telegram downloads in bytes per second.
+
+    Every transfer draws from the global bucket and its session's bucket.
+    Bulk transfers (channel downloads, batches, prefetch) also draw from a
+    bulk bucket capped at global_rate - interactive_reserve, so
+    interactive single-file downloads always have the reserve to
+    themselves while still being able to use the whole global rate when
+    nothing else runs. Any rate of 0 means unlimited.
+    """
+
+    def __init__(self, global_rate: int = 0, session_rate: int = 0, interactive_reserve: int = 0):
+        self.global_rate = 0
+        self.interactive_reserve = 0
+        self.global_bucket = TokenBucket()
+        self.bulk_bucket = TokenBucket()
+        self.session_rate = session_rate
+        self.session_overrides: Dict[str, int] = {}  # session_id -> rate, replaces session_rate
+        self.session_buckets: Dict[str, TokenBucket] = {}
+        self.meters: Dict[str, RateMeter] = {}
+        self.configure(global_rate=global_rate, interactive_reserve=interactive_reserve)
+
+    def configure(
+        self,
+        global_rate: Optional[int] = None,
+        session_rate: Optional[int] = None,
+        interactive_reserve: Optional[int] = None
+    ):
+        """Change limits at runtime; arguments left as None keep their value."""
+        global_rate = self.global_rate if global_rate is None else max(0, global_rate)
+        interactive_reserve = self.interactive_reserve if interactive_reserve is None else max(0, interactive_reserve)
+        if global_rate and interactive_reserve >= global_rate:
+            raise ValueError("Interactive reserve must be lower than the global rate")
+        self.global_rate = global_rate
+        self.interactive_reserve = interactive_reserve
+        if session_rate is not None:
+            self.session_rate = max(0, session_rate)
+            for session_id, bucket in self.session_buckets.items():
+                bucket.configure(self.get_session_rate(session_id))
+
+        self.global_bucket.configure(self.global_rate)
+        bulk_rate = self.global_rate - self.interactive_reserve if self.global_rate else 0
+        self.bulk_bucket.configure(bulk_rate)
+
+    def set_session_rate(self, session_id: str, rate: Optional[int]):
+        """Override one session's limit; None goes back to the default."""
+        if rate is None:
+            self.session_overrides.pop(session_id, None)
+        else:
+            self.session_overrides[session_id] = max(0, rate)
+        if session_id in self.session_buckets:
+            self.session_buckets[session_id].configure(self.get_session_rate(session_id))
+
+    def get_session_rate(self, session_id: str) -> int:
+        return self.session_overrides.get(session_id, self.session_rate)
+
+    async def consume(self, session_id: str, size: int, interactive: bool = False):
+        """Account for size bytes received, waiting as long as the limits require."""
+        meter = self.meters.get(session_id)
+        if meter is None:
+            meter = self.meters[session_id] = RateMeter()
+        meter.add(size)
+
+        bucket = self.session_buckets.get(session_id)
+        if bucket is None:
+            bucket = self.session_buckets[session_id] = TokenBucket(self.get_session_rate(session_id))
+        delay = max(bucket.take(size), self.global_bucket.take(size))
+        if not interactive:
+            delay = max(delay, self.bulk_bucket.take(size))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def throttle(self, session_id: str, interactive: bool = False) -> Callable[[int, int], Awaitable]:
+        """Progress callback for download_media that shapes one transfer."""
+        received = 0
+
+        async def progress(current: int, total: int):
+            nonlocal received
+            size = current - received
+            received = current
+            if size > 0:
+                await self.consume(session_id, size, interactive)
+
+        return progress
+
+    def describe(self, session_id: Optional[str] = None) -> Dict:
+        """Limits and measured throughput, for one session or all of them."""
+        if session_id is not None:
+            meter = self.meters.get(session_id)
+            return {
+                "global_limit": self.global_rate,
+                "session_limit": self.get_session_rate(session_id),
+                "session_rate": round(meter.current()) if meter else 0,
+            }
+        return {
+            "global_limit": self.global_rate,
+            "session_limit": self.session_rate,
+            "interactive_reserve": self.interactive_reserve,
+            "session_overrides": dict(self.session_overrides),
+            "global_rate": round(sum(meter.current() for meter in self.meters.values())),
+            "sessions": {
+                session_id: round(meter.current())
+                for session_id, meter in self.meters.items() if meter.current()
+            },
+        }
@@ -0,0 +1,223 @@
+"""
+Micro-benchmarks for the backend services.
+
+Runs offline against synthetic data; no Telegram connection is needed.
+
+    python benchmark.py            # run everything
+    python benchmark.py memory     # run a single benchmark
+"""
+import os
+import sys
+import time
+import subprocess
+import tempfile
+import uuid
+import tracemalloc
+from typing import Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from download_service import DownloadState
+from models import ChannelFileInfo, ListChannelFilesResponse
+from responses import FastJSONResponse, orjson
+
+
+def _measure_allocated(build: Callable) -> int:
+    """Return bytes still allocated by the object `build` returns."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return after - before
+
+
+def bench_memory(file_count: int = 100_000):
+    """Memory per tracked file: list of dicts vs. the column-wise FileTable."""
+    download_id = str(uuid.uuid4())
+    download_dir = "downloads/session/1234567890"
+
+    def build_dicts():
+        files = []
+        for i in range(file_count):
+            filename = f"video_{i:08d}.mp4"
+            files.append({
+                "filename": filename,
+                "size": 1_000_000 + i,
+                "path": f"{download_dir}/{filename}",
+                "download_url": f"/api/download/files/{download_id}/{filename}"
+            })
+        return files
+
+    def build_table():
+        state = DownloadState(download_id, 1234567890, "session")
+        state.download_dir = download_dir
+        for i in range(file_count):
+            state.files.add(f"video_{i:08d}.mp4", 1_000_000 + i)
+        return state
+
+    dict_bytes = _measure_allocated(build_dicts)
+    table_bytes = _measure_allocated(build_table)
+    print(f"memory ({file_count} files)")
+    print(f"  list of dicts: {dict_bytes / file_count:8.1f} B/file  {dict_bytes / 2**20:7.2f} MiB")
+    print(f"  FileTable:     {table_bytes / file_count:8.1f} B/file  {table_bytes / 2**20:7.2f} MiB")
+
+
+def _timed(fn: Callable, repeat: int = 3) -> float:
+    """Best wall time of `repeat` runs, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def _channel_rows(count: int) -> List[Dict]:
+    return [
+        {
+            "message_id": i,
+            "filename": f"file_{i}.mp4",
+            "size": 1_000_000 + i,
+            "mime_type": "video/mp4",
+            "date": "2026-01-01T00:00:00+00:00",
+            "is_video": True,
+            "is_photo": False
+        }
+        for i in range(count)
+    ]
+
+
+def bench_serialization(sizes=(10_000, 100_000)):
+    """/api/channel/list encoding: pydantic models + JSONResponse vs. FastJSONResponse."""
+    encoder = "orjson" if orjson is not None else "json (orjson not installed)"
+    print(f"serialization (fast path encoder: {encoder})")
+    for count in sizes:
+        rows = _channel_rows(count)
+
+        def model_path():
+            # What FastAPI does for a response_model endpoint
+            response = ListChannelFilesResponse(
+                channel_id=1,
+                channel_name="bench",
+                files=[ChannelFileInfo(**f) for f in rows],
+                total_count=len(rows)
+            )
+            JSONResponse(jsonable_encoder(response))
+
+        def fast_path():
+            FastJSONResponse({
+                "channel_id": 1,
+                "channel_name": "bench",
+                "files": rows,
+                "total_count": len(rows)
+            })
+
+        model_ms = _timed(model_path)
+        fast_ms = _timed(fast_path)
+        print(f"  {count:>7} items: models {model_ms:9.1f} ms  fast {fast_ms:8.1f} ms  ({model_ms / fast_ms:5.1f}x)")
+
+
+# Runs in a fresh interpreter so import costs are real
+# Simulated Telegram round trip for the startup probe's stub client, in seconds
+STARTUP_RTT = 0.05
+
+_STARTUP_PROBE = """
+import sys
+import time
+import asyncio
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+main.build_services()
+t2 = time.perf_counter()
+
+import telegram_service
+RTT = float(sys.argv[1])
+
+
+class StubClient(telegram_service.TelegramClient):
+    # Real client construction; the network is simulated
+    async def connect(self):
+        # TCP, then the first request on the (already authorized) key
+        await asyncio.sleep(2 * RTT)
+        self._stub_connected = True
+
+    def is_connected(self):
+        return getattr(self, "_stub_connected", False)
+
+    async def is_user_authorized(self):
+        if not getattr(self, "_stub_authorized", False):
+            await asyncio.sleep(RTT)
+            self._stub_authorized = True
+        return True
+
+
+telegram_service.TelegramClient = StubClient
+service = main.telegram_service
+for session_id in ("cold", "warm"):
+    service.session_credentials[session_id] = {"api_id": 1, "api_hash": "0" * 32}
+    service.authenticated_sessions["token-" + session_id] = session_id
+service.last_active["warm"] = time.time()
+
+
+async def first_request(token):
+    started = time.perf_counter()
+    await service.ensure_connected(service.get_client(token))
+    return time.perf_counter() - started
+
+
+async def run():
+    # Warms only the most recently active session, "warm"
+    await service.warm_up(1)
+    cold = await first_request("token-cold")
+    warm = await first_request("token-warm")
+    return cold, warm
+
+
+cold, warm = asyncio.run(run())
+print("RESULT", t1 - t0, t2 - t1, cold, warm)
+"""
+
+
+def bench_startup():
+    """
+    Time until the app can serve, background service build, and the first
+    request's get_client + ensure_connected, cold vs. after warm_up. The
+    network is simulated with STARTUP_RTT per round trip.
+    """
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = dict(os.environ, PYTHONPATH=backend_dir)
+        result = subprocess.run(
+            [sys.executable, "-c", _STARTUP_PROBE, str(STARTUP_RTT)],
+            cwd=work_dir, env=env, capture_output=True, text=True
+        )
+    lines = [line for line in result.stdout.splitlines() if line.startswith("RESULT")]
+    if not lines:
+        print(f"startup probe failed:\n{result.stderr}")
+        return
+    serve_s, build_s, cold_s, warm_s = (float(x) for x in lines[0].split()[1:])
+    print("startup")
+    print(f"  import main (API can serve):      {serve_s * 1000:8.1f} ms")
+    print(f"  build_services (in background):   {build_s * 1000:8.1f} ms")
+    print(f"  first request, cold client:       {cold_s * 1000:8.1f} ms  ({STARTUP_RTT * 1000:.0f} ms simulated round trips)")
+    print(f"  first request, warmed-up client:  {warm_s * 1000:8.1f} ms")
+
+
+BENCHMARKS: Dict[str, Callable] = {
+    "memory": bench_memory,
+    "serialization": bench_serialization,
+    "startup": bench_startup,
+}
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark '{name}'. Available: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        BENCHMARKS[name]()
@@ -1,14 +1,119 @@
 import os
+import json
 import uuid
 import asyncio
-from typing import Dict, Optional, List
-from telethon import TelegramClient
-from telethon.tl.types import MessageMediaDocument, MessageMediaPhoto
-from telethon.errors import ChannelInvalidError, ChannelPrivateError
+import shutil
+import datetime
+from array import array
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional, List, Set, Tuple
+from telethon import TelegramClient, events
+from telethon.tl.types import (
+    MessageMediaDocument,
+    MessageMediaPhoto,
+    DocumentAttributeAudio,
+    DocumentAttributeVideo,
+    PhotoSize,
+    PhotoCachedSize,
+    PhotoSizeProgressive,
+    PhotoStrippedSize
+)
+from telethon.errors import (
+    ChannelInvalidError, ChannelPrivateError, FloodWaitError, RPCError, UnauthorizedError
+)
 import re
 
+from storage_manager import StorageManager, StorageQuotaError
+from thumbnail_cache import ThumbnailCache
+from prefetcher import Prefetcher
+from integrity import ChecksumIndex, HashingWriter, IntegrityError, verify_file
+from postprocess import PostProcessor
+from manifest import ChannelIndex
+from singleflight import SingleFlight
+from bandwidth import BandwidthShaper
+from profiling import tracer
+
+
+# Seconds to wait before reconnecting a live channel mirror
+WATCH_RECONNECT_DELAY = 5
+
+# Finished jobs are spilled to disk; this many are kept loaded for repeat polls
+FINISHED_CACHE_SIZE = 16
+
+# Concurrent thumbnail transfers per preview batch
+THUMBNAIL_CONCURRENCY = 4
+
+# Remembered (channel_id, message_id) -> media id mappings for preview cache hits
+THUMBNAIL_KEY_CACHE_SIZE = 50000
+
+# Remembered (session_id, channel_id, message_id) -> local path mappings
+MEDIA_CACHE_SIZE = 100000
+
+# Re-downloads of a file whose size does not match what Telegram reported
+INTEGRITY_RETRIES = 2
+
+# Messages an account takes from a sharded job's queue at a time
+SHARD_BATCH_SIZE = 5
+
+# Seconds an idle shard worker waits for work handed back by a flood-waiting account
+SHARD_IDLE_POLL = 1
+
+
+class FileTable:
+    """
+    Files downloaded by a job, stored column-wise.
+    Only the filename and size are kept per file; path and download_url are
+    derived from the owning job when a row is read.
+    """
+    __slots__ = ("state", "filenames", "sizes", "checksums", "processing")
+
+    def __init__(self, state: "DownloadState"):
+        self.state = state
+        self.filenames: List[str] = []
+        self.sizes = array("q")
+        self.checksums: List[Optional[str]] = []  # sha256 hex digests
+        self.processing: List[Optional[Dict]] = []  # Post-processing status, None if not configured
+
+    def add(self, filename: str, size: int, sha256: Optional[str] = None) -> int:
+        """Append a file and return its index."""
+        self.filenames.append(filename)
+        self.sizes.append(size)
+        self.checksums.append(sha256)
+        self.processing.append(None)
+        return len(self.filenames) - 1
+
+    def row(self, index: int) -> Dict:
+        filename = self.filenames[index]
+        return {
+            "filename": filename,
+            "size": self.sizes[index],
+            "path": os.path.join(self.state.download_dir, filename),
+            "download_url": f"/api/download/files/{self.state.download_id}/{filename}",
+            "sha256": self.checksums[index],
+            "post_process": self.processing[index]
+        }
+
+    def __len__(self) -> int:
+        return len(self.filenames)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for index in range(len(self.filenames)):
+            yield self.row(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(i) for i in range(*index.indices(len(self.filenames)))]
+        return self.row(index)
+
 
 class DownloadState:
+    __slots__ = (
+        "download_id", "channel_id", "session_id", "status", "progress",
+        "total_files", "downloaded_files", "files", "current_file", "error",
+        "download_dir", "last_message_id", "post_process"
+    )
+
     def __init__(self, download_id: str, channel_id: int, session_id: str):
         self.download_id = download_id
         self.channel_id = channel_id
@@ -17,20 +122,110 @@ class DownloadState:
         self.progress = 0.0
         self.total_files = 0
         self.downloaded_files = 0
-        self.files: List[Dict] = []
+        self.files = FileTable(self)
         self.current_file: Optional[str] = None
         self.error: Optional[str] = None
         self.download_dir: str = ""
         self.last_message_id: Optional[int] = None
+        self.post_process: List[str] = []  # Post-processing steps run on each file
+
+    def to_dict(self) -> Dict:
+        """Serialize a finished job for spilling to disk."""
+        return {
+            "download_id": self.download_id,
+            "channel_id": self.channel_id,
+            "session_id": self.session_id,
+            "status": self.status,
+            "progress": self.progress,
+            "total_files": self.total_files,
+            "downloaded_files": self.downloaded_files,
+            "error": self.error,
+            "download_dir": self.download_dir,
+            "last_message_id": self.last_message_id,
+            "filenames": self.files.filenames,
+            "sizes": self.files.sizes.tolist(),
+            "checksums": self.files.checksums,
+            "post_process": self.post_process,
+            "processing": self.files.processing
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "DownloadState":
+        state = cls(data["download_id"], data["channel_id"], data["session_id"])
+        state.status = data["status"]
+        state.progress = data["progress"]
+        state.total_files = data["total_files"]
+        state.downloaded_files = data["downloaded_files"]
+        state.error = data["error"]
+        state.download_dir = data["download_dir"]
+        state.last_message_id = data["last_message_id"]
+        state.files.filenames = data["filenames"]
+        state.files.sizes = array("q", data["sizes"])
+        state.files.checksums = data.get("checksums") or [None] * len(data["filenames"])
+        state.post_process = data.get("post_process") or []
+        state.files.processing = data.get("processing") or [None] * len(data["filenames"])
+        return state
 
 
 class DownloadService:
-    def __init__(self, downloads_dir: str = "downloads"):
+    def __init__(
+        self,
+        downloads_dir: str = "downloads",
+        storage: Optional[StorageManager] = None,
+        thumbnails: Optional[ThumbnailCache] = None,
+        prefetcher: Optional[Prefetcher] = None,
+        postprocessor: Optional[PostProcessor] = None,
+        bandwidth: Optional[BandwidthShaper] = None
+    ):
         self.downloads_dir = downloads_dir
         os.makedirs(downloads_dir, exist_ok=True)
         
-        # In-memory storage for download states
+        # In-memory storage for running download states
         self.downloads: Dict[str, DownloadState] = {}
+        
+        # Finished jobs live on disk; recently read ones are cached here
+        self.jobs_dir = os.path.join(downloads_dir, ".jobs")
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self.finished_cache: "OrderedDict[str, DownloadState]" = OrderedDict()
+        
+        # Live channel mirrors: download_id -> {task, client, handler, event}
+        self.watchers: Dict[str, Dict] = {}
+        
+        # Disk usage accounting (quotas, LRU eviction, TTL expiry)
+        if storage is None:
+            storage = StorageManager(downloads_dir)
+            storage.scan()
+        self.storage = storage
+        
+        # Preview thumbnails, keyed by media id
+        if thumbnails is None:
+            thumbnails = ThumbnailCache(os.path.join(downloads_dir, ".thumbnails"))
+        self.thumbnails = thumbnails
+        self.thumbnail_keys: "OrderedDict[tuple, str]" = OrderedDict()
+        
+        # Local media cache: files already on disk are served without re-downloading
+        self.media_cache: "OrderedDict[tuple, str]" = OrderedDict()
+        
+        # Checksums of downloaded files, also used to reuse identical media
+        self.checksums = ChecksumIndex()
+        
+        # Speculative prefetch after listings (disabled unless a policy is set)
+        self.prefetcher = prefetcher or Prefetcher()
+        
+        # Post-download processing in worker processes, and its in-flight tasks per job
+        self.postprocessor = postprocessor or PostProcessor()
+        self.post_tasks: Dict[str, Set[asyncio.Task]] = {}
+        
+        # Channel listings indexed on disk, and channels whose index is being written
+        self.channel_index = ChannelIndex(os.path.join(downloads_dir, ".index"))
+        self.indexing: Set[int] = set()
+        
+        # Identical concurrent Telegram operations share one in-flight task
+        self.flights = SingleFlight()
+        
+        # Rate limits applied to every transfer's chunks (unlimited by default)
+        self.bandwidth = bandwidth or BandwidthShaper()
+
     
     def parse_channel_input(self, channel_input: str) -> Dict:
         """
@@ -83,6 +278,19 @@ class DownloadService:
         return {"type": "username", "value": channel_input, "original": channel_input}
     
     async def resolve_channel_id(
+        self,
+        client: TelegramClient,
+        channel_info: Dict
+    ) -> int:
+        """
+        Resolve channel username, invite link, or ID to channel ID.
+        Coalesced per account, since what an account can resolve depends on its access.
+        """
+        key = ("resolve", client, channel_info["type"], channel_info["value"])
+        with tracer.span("resolve_channel_id"):
+            return await self.flights.run(key, lambda: self._resolve_channel_id(client, channel_info))
+    
+    async def _resolve_channel_id(
         self, 
         client: TelegramClient, 
         channel_info: Dict
@@ -208,95 +416,546 @@ class DownloadService:
             )
         )
     
+    def _expected_size(self, message) -> int:
+        """Get the size Telegram reports for a message's media, 0 if unknown."""
+        try:
+            return message.file.size or 0
+        except AttributeError:
+            return 0
+    
+    def _get_cached_media(self, session_id: str, channel_id: int, message_id: int) -> Optional[str]:
+        """Get the local path of a message's media if it is already downloaded."""
+        key = (session_id, channel_id, message_id)
+        path = self.media_cache.get(key)
+        if path is None:
+            return None
+        if self.storage.stat(path) is None:
+            # Evicted or deleted since
+            del self.media_cache[key]
+            return None
+        self.media_cache.move_to_end(key)
+        self.storage.touch(path)
+        return path
+    
+    def _remember_media(self, session_id: str, channel_id: int, message_id: int, path: str):
+        key = (session_id, channel_id, message_id)
+        self.media_cache[key] = path
+        self.media_cache.move_to_end(key)
+        while len(self.media_cache) > MEDIA_CACHE_SIZE:
+            self.media_cache.popitem(last=False)
+    
+    def _media_path(self, message, download_dir: str) -> str:
+        """Pick a file name the way download_media does, without overwriting existing files."""
+        file = message.file
+        name = os.path.basename(file.name) if file and file.name else ""
+        if not name:
+            kind = "document"
+            if isinstance(message.media, MessageMediaPhoto):
+                kind = "photo"
+            elif isinstance(message.media, MessageMediaDocument) and message.media.document:
+                for attr in message.media.document.attributes:
+                    if isinstance(attr, DocumentAttributeVideo):
+                        kind = "video"
+                    elif isinstance(attr, DocumentAttributeAudio):
+                        kind = "voice" if attr.voice else "audio"
+            date = message.date or datetime.datetime.now()
+            name = f"{kind}_{date:%Y-%m-%d_%H-%M-%S}"
+        
+        stem, ext = os.path.splitext(name)
+        if not ext:
+            ext = (file.ext if file else None) or ""
+        
+        path = os.path.join(download_dir, stem + ext)
+        i = 1
+        while os.path.exists(path):
+            path = os.path.join(download_dir, f"{stem} ({i}){ext}")
+            i += 1
+        return path
+    
+    async def _fetch_media(
+        self,
+        message,
+        download_dir: str,
+        session_id: str,
+        interactive: bool = False,
+        shared: bool = True
+    ) -> Optional[Tuple[str, int, str]]:
+        """
+        Download a message's media into download_dir, hashing chunks as they arrive.
+        A file whose size differs from document.size is downloaded again. Media
+        already downloaded to the same directory is reused once its checksum
+        is verified. Returns (path, size, sha256), or None if there is nothing
+        to download. Chunks are rate limited for session_id, from the
+        interactive reserve when interactive is set.
+        
+        With shared set, concurrent fetches of the same media (from any
+        account) share one transfer; callers for other directories get a
+        link or copy of the result.
+        """
+        media_key = self._media_key(message)
+        existing = self.checksums.find_media(media_key)
+        if existing and os.path.dirname(existing) == download_dir:
+            size, sha256 = self.checksums.get(existing) or (0, "")
+            if await verify_file(existing, size, sha256):
+                return existing, size, sha256
+        
+        if not shared or not media_key:
+            return await self._transfer_media(message, download_dir, media_key, session_id, interactive)
+        
+        fetched = await self.flights.run(
+            ("media", media_key),
+            lambda: self._transfer_media(message, download_dir, media_key, session_id, interactive)
+        )
+        if not fetched or os.path.dirname(fetched[0]) == download_dir:
+            return fetched
+        
+        source, size, sha256 = fetched
+        filepath = self._media_path(message, download_dir)
+        try:
+            await self._link_or_copy(source, filepath)
+        except OSError:
+            # The shared file went away (evicted); fetch our own copy
+            return await self._transfer_media(message, download_dir, media_key, session_id, interactive)
+        self.checksums.record(filepath, size, sha256, media_key)
+        return filepath, size, sha256
+    
+    async def _link_or_copy(self, source: str, target: str):
+        """Hard-link a file into place, copying in a worker thread across filesystems."""
+        try:
+            os.link(source, target)
+        except OSError:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, shutil.copyfile, source, target)
+    
+    async def _transfer_media(
+        self,
+        message,
+        download_dir: str,
+        media_key: Optional[str],
+        session_id: str,
+        interactive: bool = False
+    ) -> Optional[Tuple[str, int, str]]:
+        """Download media from Telegram, retrying on a size mismatch."""
+        expected_size = 0
+        if isinstance(message.media, MessageMediaDocument) and message.media.document:
+            expected_size = message.media.document.size
+        
+        for attempt in range(INTEGRITY_RETRIES + 1):
+            writer = HashingWriter(self._media_path(message, download_dir))
+            try:
+                with tracer.span("download_media", message_id=message.id):
+                    result = await message.download_media(
+                        file=writer,
+                        progress_callback=self.bandwidth.throttle(session_id, interactive)
+                    )
+            except BaseException:
+                writer.discard()
+                raise
+            writer.close()
+            
+            if result is None:
+                writer.discard()
+                return None
+            if not expected_size or writer.size == expected_size:
+                sha256 = writer.hexdigest()
+                self.checksums.record(writer.path, writer.size, sha256, media_key)
+                return writer.path, writer.size, sha256
+            
+            print(f"Size mismatch for message {message.id}: got {writer.size}, expected {expected_size} (attempt {attempt + 1})")
+            writer.discard()
+        
+        raise IntegrityError(f"Downloaded size does not match for message {message.id}")
+    
+    @contextmanager
+    def _foreground(self):
+        """Mark a user-initiated transfer; speculative prefetch yields to it."""
+        self.prefetcher.foreground_started()
+        try:
+            yield
+        finally:
+            self.prefetcher.foreground_finished()
+    
     async def start_download(
         self,
         client: TelegramClient,
         channel_id: int,
-        session_id: str
+        session_id: str,
+        extra_clients: Optional[List[TelegramClient]] = None,
+        post_process: Optional[List[str]] = None
     ) -> str:
-        """Start downloading files from a channel."""
+        """
+        Start downloading files from a channel.
+        With extra_clients (other accounts with access to the channel) the
+        work is shared between all accounts. post_process names steps to run
+        on every downloaded file.
+        """
+        PostProcessor.validate_steps(post_process or [])
         download_id = str(uuid.uuid4())
         download_dir = self._get_download_dir(session_id, channel_id)
         
         # Create download state
         state = DownloadState(download_id, channel_id, session_id)
         state.download_dir = download_dir
+        state.post_process = list(post_process or [])
         state.status = "in_progress"
         self.downloads[download_id] = state
+        self.storage.protect(download_id)
         
         # Start download in background
-        asyncio.create_task(self._download_files(client, state))
+        asyncio.create_task(self._download_files(client, state, extra_clients or []))
         
         return download_id
     
-    async def _download_files(self, client: TelegramClient, state: DownloadState):
-        """Download files from channel (runs in background)."""
-        try:
-            # Ensure client is connected
-            if not client.is_connected():
-                await client.connect()
-            
-            # Read resume point
-            last_downloaded = self._read_last_message_id(state.download_dir)
+    async def _collect_new_messages(self, client: TelegramClient, state: DownloadState) -> List:
+        """Collect media messages newer than the saved resume point, oldest first."""
+        last_downloaded = self._read_last_message_id(state.download_dir)
+        if state.last_message_id is None or (last_downloaded or 0) > state.last_message_id:
             state.last_message_id = last_downloaded
+        resume_from = state.last_message_id or 0
+        
+        messages = []
+        pages = tracer.traced_pages(
+            client.iter_messages(state.channel_id, min_id=resume_from, reverse=True),
+            "iter_messages"
+        )
+        async for message in pages:
+            if self._has_media(message):
+                messages.append(message)
+        return messages
+    
+    async def _download_message(
+        self,
+        state: DownloadState,
+        message,
+        save_progress: bool = True,
+        raise_flood_wait: bool = False
+    ) -> bool:
+        """Download one message's media into the job's directory and record it."""
+        try:
+            state.current_file = f"Message ID {message.id}"
+            self.storage.ensure_space(state.session_id, self._expected_size(message))
+            with self._foreground():
+                fetched = await self._fetch_media(message, state.download_dir, state.session_id)
             
-            if last_downloaded is not None:
-                resume_from = last_downloaded
-            else:
-                resume_from = 0
-            
-            # Collect messages with media
-            messages = []
-            async for message in client.iter_messages(
-                state.channel_id,
-                min_id=resume_from,
-                reverse=True
-            ):
-                if self._has_media(message):
-                    messages.append(message)
+            if fetched:
+                filepath, file_size, sha256 = fetched
+                self.storage.record_file(filepath, file_size, state.session_id, state.download_id)
+                self._remember_media(state.session_id, state.channel_id, message.id, filepath)
+                
+                index = state.files.add(os.path.basename(filepath), file_size, sha256)
+                state.downloaded_files += 1
+                
+                if state.post_process:
+                    await self._queue_post_process(state, index, filepath)
+                
+                # Save progress
+                if save_progress and message.id > (state.last_message_id or 0):
+                    self._save_last_message_id(state.download_dir, message.id)
+                    state.last_message_id = message.id
             
-            state.total_files = len(messages)
+            # Update progress
+            if state.total_files:
+                state.progress = (state.downloaded_files / state.total_files) * 100
+            return bool(fetched)
             
-            if state.total_files == 0:
+        except FloodWaitError:
+            if raise_flood_wait:
+                raise
+            print(f"Error downloading message {message.id}: rate limited")
+            return False
+        except Exception as e:
+            # Caller continues with next file on error
+            print(f"Error downloading message {message.id}: {e}")
+            return False
+    
+    async def _queue_post_process(self, state: DownloadState, index: int, filepath: str):
+        """Hand a file to the process pool; waits while the pool is backed up."""
+        state.files.processing[index] = {"status": "pending"}
+        try:
+            future = await self.postprocessor.submit(filepath, state.post_process)
+        except asyncio.CancelledError:
+            # Job stopped while waiting for a free slot
+            state.files.processing[index] = {"status": "failed", "error": "Cancelled"}
+            raise
+        except Exception as e:
+            state.files.processing[index] = {"status": "failed", "error": str(e)}
+            return
+        task = asyncio.ensure_future(self._finish_post_process(state, index, future))
+        tasks = self.post_tasks.setdefault(state.download_id, set())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    
+    async def _finish_post_process(self, state: DownloadState, index: int, future: asyncio.Future):
+        """Record a file's post-processing results in the job state."""
+        try:
+            results = await future
+        except Exception as e:
+            state.files.processing[index] = {"status": "failed", "error": str(e)}
+            return
+        
+        failed = False
+        for step, result in results.items():
+            if "error" in result:
+                failed = True
+                continue
+            outputs = [output for output in result.get("outputs", []) if os.path.exists(output)]
+            sizes = [os.path.getsize(output) for output in outputs]
+            # Outputs count towards the quotas like downloads; drop what does not fit
+            try:
+                self.storage.ensure_space(state.session_id, sum(sizes))
+            except StorageQuotaError as e:
+                self._remove_outputs(outputs, state.download_dir)
+                results[step] = {"error": f"Outputs do not fit: {e}"}
+                failed = True
+                continue
+            for output, size in zip(outputs, sizes):
+                self.storage.record_file(output, size, state.session_id, state.download_id)
+            # Served by the files endpoint under these relative paths
+            result["outputs"] = [os.path.relpath(output, state.download_dir) for output in outputs]
+        
+        state.files.processing[index] = {
+            "status": "failed" if failed else "completed",
+            "steps": results
+        }
+    
+    def _remove_outputs(self, outputs: List[str], download_dir: str):
+        """Delete post-processing outputs and the directories they leave empty."""
+        for output in outputs:
+            try:
+                os.remove(output)
+            except OSError:
+                pass
+            parent = os.path.dirname(output)
+            while parent != download_dir and parent.startswith(download_dir + os.sep):
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
+    
+    async def _wait_post_process(self, state: DownloadState):
+        """Wait for a job's outstanding post-processing."""
+        tasks = self.post_tasks.pop(state.download_id, set())
+        if tasks:
+            state.current_file = "Post-processing"
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _download_sharded(
+        self,
+        clients: List[TelegramClient],
+        state: DownloadState,
+        messages: List
+    ):
+        """
+        Download messages with one worker per account pulling from a shared queue.
+        An account that hits a flood wait hands its unfinished messages back
+        for the others to take, then rejoins after the wait. Short flood waits
+        are slept through inside Telethon's call instead; meanwhile idle
+        workers steal the messages that account has taken but not started.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for message in messages:
+            queue.put_nowait(message)
+        
+        # Resume point only advances past messages that are all finished
+        order = [message.id for message in messages]
+        finished = set()
+        watermark = 0
+        
+        def mark_finished(message_id: int):
+            nonlocal watermark
+            finished.add(message_id)
+            while watermark < len(order) and order[watermark] in finished:
+                watermark += 1
+            if watermark and order[watermark - 1] > (state.last_message_id or 0):
+                self._save_last_message_id(state.download_dir, order[watermark - 1])
+                state.last_message_id = order[watermark - 1]
+        
+        # Messages each worker has taken but not started yet
+        claims: List[deque] = []
+        
+        def take_batch() -> List:
+            batch = []
+            while len(batch) < SHARD_BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+            if not batch:
+                # Steal half of the largest backlog, e.g. from an account
+                # Telethon keeps asleep in a flood wait
+                victim = max(claims, key=len, default=None)
+                for _ in range((len(victim) + 1) // 2 if victim else 0):
+                    batch.append(victim.pop())
+            return batch
+        
+        async def worker(client: TelegramClient, is_primary: bool):
+            claimed: deque = deque()
+            claims.append(claimed)
+            while len(finished) < len(order):
+                batch = take_batch()
+                if not batch:
+                    await asyncio.sleep(SHARD_IDLE_POLL)
+                    continue
+                
+                claimed.extend(batch)
+                current = None
+                try:
+                    copies = {}
+                    if not is_primary:
+                        # File references are per account, so fetch this account's copies
+                        with tracer.span("get_messages", count=len(batch)):
+                            own = await client.get_messages(state.channel_id, ids=[m.id for m in batch])
+                        copies = {message.id: message for message in own if message is not None}
+                    while claimed:
+                        current = claimed.popleft()
+                        message = current if is_primary else copies.get(current.id)
+                        if message is not None:
+                            await self._download_message(
+                                state, message, save_progress=False, raise_flood_wait=True
+                            )
+                        mark_finished(current.id)
+                        current = None
+                except FloodWaitError as e:
+                    pending = ([current] if current else []) + list(claimed)
+                    claimed.clear()
+                    for message in pending:
+                        queue.put_nowait(message)
+                    print(f"Shard worker rate limited for {e.seconds}s, handing back {len(pending)} messages")
+                    await asyncio.sleep(e.seconds)
+                except Exception as e:
+                    # This account cannot continue; leave its work to the others
+                    claims.remove(claimed)
+                    for message in ([current] if current else []) + list(claimed):
+                        queue.put_nowait(message)
+                    print(f"Shard worker stopped: {e}")
+                    return
+        
+        await asyncio.gather(*(
+            worker(client, index == 0) for index, client in enumerate(clients)
+        ))
+    
+    async def _download_files(
+        self,
+        client: TelegramClient,
+        state: DownloadState,
+        extra_clients: Optional[List[TelegramClient]] = None
+    ):
+        """Download files from channel (runs in background)."""
+        with tracer.start_trace(f"download {state.download_id}"):
+            try:
+                # Ensure client is connected
+                if not client.is_connected():
+                    await client.connect()
+                
+                # Collect messages with media after the resume point
+                messages = await self._collect_new_messages(client, state)
+                state.total_files = len(messages)
+                
+                if state.total_files == 0:
+                    state.status = "completed"
+                    state.progress = 100.0
+                    return
+                
+                if extra_clients:
+                    await self._download_sharded([client] + extra_clients, state, messages)
+                else:
+                    # Download files sequentially
+                    for message in messages:
+                        await self._download_message(state, message)
+                
+                await self._wait_post_process(state)
+                
                 state.status = "completed"
                 state.progress = 100.0
-                return
-            
-            # Download files sequentially
-            for idx, message in enumerate(messages, 1):
+                state.current_file = None
+                
+            except ChannelInvalidError:
+                state.status = "failed"
+                state.error = "Invalid channel"
+            except ChannelPrivateError:
+                state.status = "failed"
+                state.error = "Channel is private or access denied"
+            except Exception as e:
+                state.status = "failed"
+                state.error = str(e)
+            finally:
+                self.post_tasks.pop(state.download_id, None)
+                self.storage.release(state.download_id)
+                self._spill_state(state)
+    
+    async def start_watch(
+        self,
+        client: TelegramClient,
+        channel_id: int,
+        session_id: str,
+        post_process: Optional[List[str]] = None
+    ) -> str:
+        """Mirror a channel: catch up from the saved resume point, then follow new posts."""
+        PostProcessor.validate_steps(post_process or [])
+        download_id = str(uuid.uuid4())
+        download_dir = self._get_download_dir(session_id, channel_id)
+        
+        state = DownloadState(download_id, channel_id, session_id)
+        state.download_dir = download_dir
+        state.post_process = list(post_process or [])
+        state.status = "watching"
+        self.downloads[download_id] = state
+        self.storage.protect(download_id)
+        
+        # New posts are pushed by Telegram, so an idle mirror costs no API calls
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def on_new_message(event):
+            if self._has_media(event.message):
+                queue.put_nowait(event.message)
+        
+        event_filter = events.NewMessage(chats=channel_id)
+        client.add_event_handler(on_new_message, event_filter)
+        
+        task = asyncio.create_task(self._watch_channel(client, state, queue))
+        self.watchers[download_id] = {
+            "task": task,
+            "client": client,
+            "handler": on_new_message,
+            "event": event_filter
+        }
+        return download_id
+    
+    async def _watch_channel(self, client: TelegramClient, state: DownloadState, queue: asyncio.Queue):
+        """Follow a channel until stopped (runs in background)."""
+        # Spans outside the traces below must not land in start_watch's request trace
+        tracer.current.set(None)
+        try:
+            while True:
                 try:
-                    state.current_file = f"Message ID {message.id}"
-                    filepath = await message.download_media(file=state.download_dir)
+                    if not client.is_connected():
+                        await client.connect()
                     
-                    if filepath:
-                        filename = os.path.basename(filepath)
-                        file_size = os.path.getsize(filepath) if os.path.exists(filepath) else 0
-                        
-                        file_info = {
-                            "filename": filename,
-                            "size": file_size,
-                            "path": filepath,
-                            "download_url": f"/api/download/files/{state.download_id}/{filename}"
-                        }
-                        state.files.append(file_info)
-                        state.downloaded_files += 1
-                        
-                        # Save progress
-                        self._save_last_message_id(state.download_dir, message.id)
-                        state.last_message_id = message.id
-                    
-                    # Update progress
-                    state.progress = (state.downloaded_files / state.total_files) * 100
+                    # Gap-fill anything posted while we were not listening. A flood
+                    # wait stops the pass before the resume point moves past the
+                    # message; the next catch-up starts from it again.
+                    with tracer.start_trace(f"watch {state.download_id} catch-up"):
+                        for message in await self._collect_new_messages(client, state):
+                            state.total_files += 1
+                            await self._download_message(state, message, raise_flood_wait=True)
+                    state.current_file = None
                     
-                except Exception as e:
-                    # Continue with next file on error
-                    print(f"Error downloading message {message.id}: {e}")
-                    continue
-            
+                    await self._drain_live_messages(client, state, queue)
+                except (ChannelInvalidError, ChannelPrivateError, UnauthorizedError):
+                    raise
+                except FloodWaitError as e:
+                    print(f"Watch {state.download_id} rate limited for {e.seconds}s")
+                    await asyncio.sleep(e.seconds)
+                except (ConnectionError, OSError) as e:
+                    print(f"Watch {state.download_id} lost connection: {e}")
+                except RPCError as e:
+                    # Transient Telegram errors should not end a long-lived mirror
+                    print(f"Watch {state.download_id} got an error from Telegram, retrying: {e}")
+                
+                # Disconnected or failed: wait a little, then reconnect and catch up
+                await asyncio.sleep(WATCH_RECONNECT_DELAY)
+                
+        except asyncio.CancelledError:
             state.status = "completed"
-            state.progress = 100.0
             state.current_file = None
-            
         except ChannelInvalidError:
             state.status = "failed"
             state.error = "Invalid channel"
@@ -306,90 +965,241 @@ class DownloadService:
         except Exception as e:
             state.status = "failed"
             state.error = str(e)
+        finally:
+            watcher = self.watchers.pop(state.download_id, None)
+            if watcher:
+                client.remove_event_handler(watcher["handler"], watcher["event"])
+            # Record results of files still in the pool before the state goes to disk
+            current_file = state.current_file
+            await self._wait_post_process(state)
+            state.current_file = current_file
+            self.storage.release(state.download_id)
+            self._spill_state(state)
+    
+    async def _drain_live_messages(self, client: TelegramClient, state: DownloadState, queue: asyncio.Queue):
+        """Download pushed messages as they arrive; returns when the client disconnects."""
+        disconnected = asyncio.ensure_future(client.disconnected)
+        try:
+            while True:
+                next_message = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    {next_message, disconnected},
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if next_message not in done:
+                    next_message.cancel()
+                    return
+                
+                message = next_message.result()
+                # Already covered by the catch-up
+                if message.id <= (state.last_message_id or 0):
+                    continue
+                state.total_files += 1
+                with tracer.start_trace(f"watch {state.download_id} message {message.id}"):
+                    await self._download_message(state, message, raise_flood_wait=True)
+                state.current_file = None
+        finally:
+            disconnected.cancel()
+    
+    async def stop_watch(self, download_id: str) -> bool:
+        """Stop a live channel mirror. Returns False if it is not running."""
+        watcher = self.watchers.get(download_id)
+        if not watcher:
+            return False
+        watcher["task"].cancel()
+        try:
+            await watcher["task"]
+        except asyncio.CancelledError:
+            pass
+        return True
+    
+    def _get_job_file(self, download_id: str) -> Optional[str]:
+        """Get the spill file path for a job, or None for a malformed ID."""
+        try:
+            uuid.UUID(download_id)
+        except ValueError:
+            return None
+        return os.path.join(self.jobs_dir, f"{download_id}.json")
+    
+    def _spill_state(self, state: DownloadState):
+        """Move a finished job out of memory and onto disk."""
+        job_file = self._get_job_file(state.download_id)
+        try:
+            tmp_file = job_file + ".tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(state.to_dict(), f)
+            os.replace(tmp_file, job_file)
+        except IOError as e:
+            # Keep it in memory rather than lose it
+            print(f"Error spilling download {state.download_id}: {e}")
+            return
+        self.downloads.pop(state.download_id, None)
+        self._cache_finished(state)
+    
+    def _cache_finished(self, state: DownloadState):
+        self.finished_cache[state.download_id] = state
+        self.finished_cache.move_to_end(state.download_id)
+        while len(self.finished_cache) > FINISHED_CACHE_SIZE:
+            self.finished_cache.popitem(last=False)
     
     def get_download_status(self, download_id: str) -> Optional[DownloadState]:
         """Get download status by ID."""
-        return self.downloads.get(download_id)
+        state = self.downloads.get(download_id) or self.finished_cache.get(download_id)
+        if state:
+            return state
+        
+        # Finished job that was spilled to disk
+        job_file = self._get_job_file(download_id)
+        if not job_file or not os.path.exists(job_file):
+            return None
+        try:
+            with open(job_file, 'r') as f:
+                state = DownloadState.from_dict(json.load(f))
+        except (ValueError, KeyError, IOError):
+            return None
+        self._cache_finished(state)
+        return state
+    
+    def file_rows(self, state: DownloadState, start: int = 0) -> List[Dict]:
+        """
+        A job's file rows from `start`. Files the storage manager has since
+        evicted or expired are flagged and lose their download_url.
+        """
+        rows = state.files[start:]
+        for row in rows:
+            row["evicted"] = not self.storage.is_tracked(row["path"])
+            if row["evicted"]:
+                row["download_url"] = None
+        return rows
     
     def get_download_file_path(self, download_id: str, filename: str) -> Optional[str]:
         """Get file path for download."""
-        state = self.downloads.get(download_id)
+        state = self.get_download_status(download_id)
         if not state:
             return None
         
+        # Post-processing outputs are in subdirectories; refuse paths leaving the job's directory
         file_path = os.path.join(state.download_dir, filename)
-        if os.path.exists(file_path):
+        root = os.path.realpath(state.download_dir)
+        if os.path.commonpath([root, os.path.realpath(file_path)]) != root or os.path.isdir(file_path):
+            return None
+        if self.storage.stat(file_path) is not None:
+            self.storage.touch(file_path)
             return file_path
+        self.storage.forget(file_path)
         return None
     
+    def _file_info(self, message) -> Dict:
+        """Build a ChannelFileInfo row for a media message."""
+        file_info = {
+            "message_id": message.id,
+            "filename": "",
+            "size": 0,
+            "mime_type": None,
+            "date": message.date.isoformat() if message.date else None,
+            "is_video": False,
+            "is_photo": False
+        }
+        
+        # Extract file information
+        if isinstance(message.media, MessageMediaDocument):
+            doc = message.media.document
+            if doc:
+                file_info["size"] = doc.size
+                file_info["mime_type"] = doc.mime_type
+                
+                # Check if it's a video
+                for attr in doc.attributes:
+                    if hasattr(attr, 'video'):
+                        file_info["is_video"] = True
+                        break
+                
+                # Get filename
+                for attr in doc.attributes:
+                    if hasattr(attr, 'file_name'):
+                        file_info["filename"] = attr.file_name
+                        break
+                
+                if not file_info["filename"]:
+                    # Generate filename from mime type
+                    ext = ""
+                    if file_info["mime_type"]:
+                        if "/" in file_info["mime_type"]:
+                            ext = "." + file_info["mime_type"].split("/")[1]
+                    file_info["filename"] = f"file_{message.id}{ext}"
+        
+        elif isinstance(message.media, MessageMediaPhoto):
+            file_info["is_photo"] = True
+            file_info["filename"] = f"photo_{message.id}.jpg"
+            file_info["mime_type"] = "image/jpeg"
+        
+        return file_info
+    
+    async def iter_channel_files(
+        self,
+        client: TelegramClient,
+        channel_id: int,
+        refresh: bool = False
+    ) -> AsyncIterator[Dict]:
+        """
+        Yield a channel's file rows, oldest first, one at a time.
+        Rows come from the local index, then from Telegram for posts newer
+        than the index; refresh re-reads the whole channel from Telegram.
+        Rows fetched from Telegram are added to the index as they pass.
+        """
+        last_message_id = 0
+        if not refresh:
+            for row in self.channel_index.read(channel_id):
+                last_message_id = row["message_id"]
+                yield row
+        
+        # Only one listing at a time writes a channel's index
+        writer = None
+        if channel_id not in self.indexing:
+            self.indexing.add(channel_id)
+            rebuild = refresh or not self.channel_index.exists(channel_id)
+            writer = self.channel_index.writer(channel_id, rebuild=rebuild)
+        
+        try:
+            pages = tracer.traced_pages(
+                client.iter_messages(channel_id, min_id=last_message_id, reverse=True),
+                "iter_messages"
+            )
+            async for message in pages:
+                if self._has_media(message):
+                    row = self._file_info(message)
+                    if writer:
+                        writer.write(row)
+                    yield row
+        except BaseException:
+            if writer:
+                writer.abort()
+            raise
+        else:
+            if writer:
+                writer.commit()
+        finally:
+            if writer:
+                self.indexing.discard(channel_id)
+    
     async def list_channel_files(
         self,
         client: TelegramClient,
         channel_id: int
     ) -> List[Dict]:
         """List all files from a channel without downloading."""
-        files = []
-        
         try:
             # Ensure client is connected
             if not client.is_connected():
                 await client.connect()
             
-            # Get channel entity for name
-            try:
-                entity = await client.get_entity(channel_id)
-                channel_name = getattr(entity, 'title', None) or getattr(entity, 'username', None)
-            except:
-                channel_name = None
-            
-            # Collect messages with media
-            async for message in client.iter_messages(channel_id, reverse=True):
-                if self._has_media(message):
-                    file_info = {
-                        "message_id": message.id,
-                        "filename": "",
-                        "size": 0,
-                        "mime_type": None,
-                        "date": message.date.isoformat() if message.date else None,
-                        "is_video": False,
-                        "is_photo": False
-                    }
-                    
-                    # Extract file information
-                    if isinstance(message.media, MessageMediaDocument):
-                        doc = message.media.document
-                        if doc:
-                            file_info["size"] = doc.size
-                            file_info["mime_type"] = doc.mime_type
-                            
-                            # Check if it's a video
-                            for attr in doc.attributes:
-                                if hasattr(attr, 'video'):
-                                    file_info["is_video"] = True
-                                    break
-                            
-                            # Get filename
-                            for attr in doc.attributes:
-                                if hasattr(attr, 'file_name'):
-                                    file_info["filename"] = attr.file_name
-                                    break
-                            
-                            if not file_info["filename"]:
-                                # Generate filename from mime type
-                                ext = ""
-                                if file_info["mime_type"]:
-                                    if "/" in file_info["mime_type"]:
-                                        ext = "." + file_info["mime_type"].split("/")[1]
-                                file_info["filename"] = f"file_{message.id}{ext}"
-                    
-                    elif isinstance(message.media, MessageMediaPhoto):
-                        file_info["is_photo"] = True
-                        file_info["filename"] = f"photo_{message.id}.jpg"
-                        file_info["mime_type"] = "image/jpeg"
-                    
-                    files.append(file_info)
+            # A listing always re-reads the channel, and refreshes its index.
+            # The caller has resolved channel_id with its own client, so
+            # concurrent listings of a channel share one, whichever account runs it.
+            async def collect() -> List[Dict]:
+                return [row async for row in self.iter_channel_files(client, channel_id, refresh=True)]
             
-            return files
+            return await self.flights.run(("list", channel_id), collect)
             
         except ChannelInvalidError:
             raise ValueError("Invalid channel")
@@ -398,6 +1208,111 @@ class DownloadService:
         except Exception as e:
             raise ValueError(f"Failed to list files: {str(e)}")
     
+    def _media_key(self, message) -> Optional[str]:
+        """Cache key for a message's media; media ids are shared by every copy of a file."""
+        if isinstance(message.media, MessageMediaDocument) and message.media.document:
+            return f"doc{message.media.document.id}"
+        if isinstance(message.media, MessageMediaPhoto) and message.media.photo:
+            return f"photo{message.media.photo.id}"
+        return None
+    
+    def _smallest_thumb(self, message):
+        """Pick the smallest downloadable thumbnail of a message's media, or None."""
+        sizes = []
+        if isinstance(message.media, MessageMediaDocument) and message.media.document:
+            sizes = message.media.document.thumbs or []
+        elif isinstance(message.media, MessageMediaPhoto) and message.media.photo:
+            sizes = message.media.photo.sizes or []
+        
+        def byte_size(size) -> int:
+            if isinstance(size, PhotoSize):
+                return size.size
+            if isinstance(size, PhotoCachedSize):
+                return len(size.bytes)
+            return max(size.sizes)
+        
+        candidates = [
+            s for s in sizes
+            if isinstance(s, (PhotoSize, PhotoCachedSize, PhotoSizeProgressive))
+        ]
+        if candidates:
+            return min(candidates, key=byte_size)
+        
+        # Only the inline blurred placeholder is available
+        return next((s for s in sizes if isinstance(s, PhotoStrippedSize)), None)
+    
+    def _remember_thumbnail_key(self, channel_id: int, message_id: int, key: str):
+        self.thumbnail_keys[(channel_id, message_id)] = key
+        self.thumbnail_keys.move_to_end((channel_id, message_id))
+        while len(self.thumbnail_keys) > THUMBNAIL_KEY_CACHE_SIZE:
+            self.thumbnail_keys.popitem(last=False)
+    
+    async def get_thumbnails(
+        self,
+        client: TelegramClient,
+        channel_id: int,
+        message_ids: List[int]
+    ) -> Dict[int, Optional[bytes]]:
+        """
+        Get preview JPEGs for several messages, None where media has no thumbnail.
+        Cache misses are resolved with one get_messages call and a few small
+        concurrent thumbnail transfers.
+        """
+        results: Dict[int, Optional[bytes]] = {}
+        missing = []
+        for message_id in message_ids:
+            key = self.thumbnail_keys.get((channel_id, message_id))
+            data = self.thumbnails.get(key) if key else None
+            if data is not None:
+                results[message_id] = data
+            else:
+                missing.append(message_id)
+        
+        if not missing:
+            return results
+        
+        try:
+            # Ensure client is connected
+            if not client.is_connected():
+                await client.connect()
+            
+            with tracer.span("get_messages", count=len(missing)):
+                messages = await client.get_messages(channel_id, ids=missing)
+        except ChannelInvalidError:
+            raise ValueError("Invalid channel")
+        except ChannelPrivateError:
+            raise ValueError("Channel is private or access denied")
+        except Exception as e:
+            raise ValueError(f"Failed to get previews: {str(e)}")
+        
+        semaphore = asyncio.Semaphore(THUMBNAIL_CONCURRENCY)
+        
+        async def fetch(message_id: int, message):
+            results[message_id] = None
+            if not message or not self._has_media(message):
+                return
+            key = self._media_key(message)
+            data = self.thumbnails.get(key)
+            if data is None:
+                thumb = self._smallest_thumb(message)
+                if thumb is None:
+                    return
+                try:
+                    async with semaphore:
+                        # By type: Telethon does not accept a PhotoSizeProgressive object here
+                        data = await client.download_media(message, file=bytes, thumb=thumb.type)
+                except Exception as e:
+                    print(f"Error downloading thumbnail for message {message_id}: {e}")
+                    return
+                if not data:
+                    return
+                self.thumbnails.put(key, data)
+            self._remember_thumbnail_key(channel_id, message_id, key)
+            results[message_id] = data
+        
+        await asyncio.gather(*(fetch(mid, msg) for mid, msg in zip(missing, messages)))
+        return results
+    
     async def download_single_file(
         self,
         client: TelegramClient,
@@ -406,13 +1321,36 @@ class DownloadService:
         session_id: str
     ) -> str:
         """Download a single file by message ID."""
+        self.prefetcher.record_request(channel_id, message_id)
+        
+        # Already on disk (earlier download or prefetch)
+        cached = self._get_cached_media(session_id, channel_id, message_id)
+        if cached:
+            return cached
+        
+        # Files land in the session's directory and count against its quota,
+        # so requests coalesce per session; the transfer itself is shared
+        # across sessions by _fetch_media.
+        return await self.flights.run(
+            ("file", session_id, channel_id, message_id),
+            lambda: self._download_single_file(client, channel_id, message_id, session_id)
+        )
+    
+    async def _download_single_file(
+        self,
+        client: TelegramClient,
+        channel_id: int,
+        message_id: int,
+        session_id: str
+    ) -> str:
         try:
             # Ensure client is connected
             if not client.is_connected():
                 await client.connect()
             
             # Get the message
-            message = await client.get_messages(channel_id, ids=message_id)
+            with tracer.span("get_messages"):
+                message = await client.get_messages(channel_id, ids=message_id)
             
             if not message or not self._has_media(message):
                 raise ValueError("Message not found or has no media")
@@ -421,11 +1359,17 @@ class DownloadService:
             download_dir = self._get_download_dir(session_id, channel_id)
             
             # Download the file
-            filepath = await message.download_media(file=download_dir)
+            self.storage.ensure_space(session_id, self._expected_size(message))
+            with self._foreground():
+                fetched = await self._fetch_media(message, download_dir, session_id, interactive=True)
             
-            if not filepath:
+            if not fetched:
                 raise ValueError("Failed to download file")
             
+            filepath, file_size, _ = fetched
+            self.storage.record_file(filepath, file_size, session_id)
+            self._remember_media(session_id, channel_id, message_id, filepath)
+            
             return filepath
             
         except Exception as e:
@@ -442,6 +1386,10 @@ class DownloadService:
         downloaded_files = []
         download_dir = self._get_download_dir(session_id, channel_id)
         
+        # Keep earlier files of this batch from being evicted by later ones
+        batch_id = str(uuid.uuid4())
+        self.storage.protect(batch_id)
+        
         try:
             # Ensure client is connected
             if not client.is_connected():
@@ -449,24 +1397,42 @@ class DownloadService:
             
             for message_id in message_ids:
                 try:
+                    # Already on disk (earlier download or prefetch)
+                    cached = self._get_cached_media(session_id, channel_id, message_id)
+                    if cached:
+                        downloaded_files.append({
+                            "message_id": message_id,
+                            "filename": os.path.basename(cached),
+                            "size": os.path.getsize(cached),
+                            "path": cached,
+                            "sha256": self.checksums.get_sha256(cached),
+                            "success": True
+                        })
+                        continue
+                    
                     # Get the message
-                    message = await client.get_messages(channel_id, ids=message_id)
+                    with tracer.span("get_messages"):
+                        message = await client.get_messages(channel_id, ids=message_id)
                     
                     if not message or not self._has_media(message):
                         continue
                     
                     # Download the file
-                    filepath = await message.download_media(file=download_dir)
+                    self.storage.ensure_space(session_id, self._expected_size(message))
+                    with self._foreground():
+                        fetched = await self._fetch_media(message, download_dir, session_id)
                     
-                    if filepath:
-                        filename = os.path.basename(filepath)
-                        file_size = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+                    if fetched:
+                        filepath, file_size, sha256 = fetched
+                        self.storage.record_file(filepath, file_size, session_id, batch_id)
+                        self._remember_media(session_id, channel_id, message_id, filepath)
                         
                         downloaded_files.append({
                             "message_id": message_id,
-                            "filename": filename,
+                            "filename": os.path.basename(filepath),
                             "size": file_size,
                             "path": filepath,
+                            "sha256": sha256,
                             "success": True
                         })
                 except Exception as e:
@@ -483,4 +1449,63 @@ class DownloadService:
             
         except Exception as e:
             raise ValueError(f"Failed to download files: {str(e)}")
-
+        finally:
+            self.storage.release(batch_id)
+    
+    def schedule_prefetch(
+        self,
+        client: TelegramClient,
+        channel_id: int,
+        session_id: str,
+        files: List[Dict]
+    ):
+        """Prefetch the files a listing's viewer is most likely to open next."""
+        if not self.prefetcher.enabled:
+            return
+        candidates = self.prefetcher.select_candidates(
+            channel_id,
+            files,
+            lambda message_id: (session_id, channel_id, message_id) in self.media_cache
+        )
+        self.prefetcher.schedule(
+            lambda file_info: self._prefetch_file(client, channel_id, session_id, file_info),
+            candidates
+        )
+    
+    async def _prefetch_file(
+        self,
+        client: TelegramClient,
+        channel_id: int,
+        session_id: str,
+        file_info: Dict
+    ):
+        """Download one prefetch candidate into the session's media cache."""
+        message_id = file_info["message_id"]
+        with tracer.span("get_messages"):
+            message = await client.get_messages(channel_id, ids=message_id)
+        if not message or not self._has_media(message):
+            return
+        
+        # Only use free space; never evict files to make room for a guess
+        if not self.storage.fits(session_id, self._expected_size(message)):
+            return
+        
+        # Download into a scratch directory so a cancelled prefetch leaves no partial file behind
+        download_dir = self._get_download_dir(session_id, channel_id)
+        part_dir = os.path.join(download_dir, ".prefetch")
+        os.makedirs(part_dir, exist_ok=True)
+        try:
+            # Not shared: a cancelled prefetch must stop its transfer
+            fetched = await self._fetch_media(message, part_dir, session_id, shared=False)
+            if not fetched:
+                return
+            
+            part_path, file_size, sha256 = fetched
+            filepath = self._media_path(message, download_dir)
+            os.replace(part_path, filepath)
+            self.checksums.record(filepath, file_size, sha256, self._media_key(message))
+        finally:
+            shutil.rmtree(part_dir, ignore_errors=True)
+        
+        self.storage.record_file(filepath, file_size, session_id)
+        self._remember_media(session_id, channel_id, message_id, filepath)
@@ -0,0 +1,116 @@
+import os
+import asyncio
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+
+# Bytes read per step when hashing a file already on disk
+HASH_READ_SIZE = 1024 * 1024
+
+# Threads for whole-file verification, kept off the event loop
+_hash_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hash")
+
+
+class IntegrityError(ValueError):
+    """Raised when downloaded media does not match what Telegram reported."""
+
+
+class HashingWriter:
+    """
+    File-like sink for TelegramClient.download_media that writes chunks to
+    `path` and feeds them to sha256 as they arrive, so the checksum is ready
+    the moment the last chunk lands.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._file = open(path, 'wb')
+
+    def write(self, chunk: bytes) -> int:
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+        return self._file.write(chunk)
+
+    def tell(self) -> int:
+        return self.size
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        """Close and delete a bad or partial file."""
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def hexdigest(self) -> str:
+        return self._sha256.hexdigest()
+
+
+def hash_file(path: str) -> str:
+    """Compute a file's sha256 (blocking)."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_READ_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+async def verify_file(path: str, size: int, sha256: str) -> bool:
+    """Check a file on disk against a recorded size and checksum in a worker thread."""
+    try:
+        if os.path.getsize(path) != size:
+            return False
+    except OSError:
+        return False
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_hash_executor, hash_file, path) == sha256
+    except OSError:
+        return False
+
+
+class ChecksumIndex:
+    """Known checksums of local files, and which file holds each Telegram media id."""
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self.by_path: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()  # path -> (size, sha256)
+        self.by_media: "OrderedDict[str, str]" = OrderedDict()  # media key -> path
+
+    def record(self, path: str, size: int, sha256: str, media_key: Optional[str] = None):
+        self.by_path[path] = (size, sha256)
+        self.by_path.move_to_end(path)
+        if media_key:
+            self.by_media[media_key] = path
+            self.by_media.move_to_end(media_key)
+        while len(self.by_path) > self.max_entries:
+            self.by_path.popitem(last=False)
+        while len(self.by_media) > self.max_entries:
+            self.by_media.popitem(last=False)
+
+    def get(self, path: str) -> Optional[Tuple[int, str]]:
+        """Return (size, sha256) recorded for a path."""
+        return self.by_path.get(path)
+
+    def get_sha256(self, path: str) -> Optional[str]:
+        entry = self.by_path.get(path)
+        return entry[1] if entry else None
+
+    def find_media(self, media_key: Optional[str]) -> Optional[str]:
+        """Return the local path last recorded for a media id."""
+        if not media_key:
+            return None
+        return self.by_media.get(media_key)
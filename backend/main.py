@@ -1,7 +1,13 @@
 import os
-from fastapi import FastAPI, HTTPException, Depends, Header
+import hmac
+import time
+import threading
+import base64
+import asyncio
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 import uvicorn
@@ -9,11 +15,13 @@ import uvicorn
 from models import (
     SendCodeRequest, SendCodeResponse, VerifyCodeRequest, VerifyCodeResponse,
     StartDownloadRequest, StartDownloadResponse, DownloadStatusResponse,
-    ListChannelFilesRequest, ListChannelFilesResponse, ChannelFileInfo,
-    DownloadAllRequest
+    ListChannelFilesRequest, ListChannelFilesResponse,
+    DownloadAllRequest, PreviewBatchRequest, ExportChannelRequest, BandwidthConfigRequest,
+    ProfileRequest
 )
-from telegram_service import TelegramService
-from download_service import DownloadService
+from responses import FastJSONResponse, RangeFileResponse
+from manifest import ENCODERS, MANIFEST_FORMATS, parquet_available
+from profiling import tracer, Trace, SamplingProfiler, LoopMonitor
 
 load_dotenv()
 
@@ -36,9 +44,116 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services (API credentials now come from user input)
-telegram_service = TelegramService()
-download_service = DownloadService()
+# Services are built in the background by load_services() so the API starts
+# serving at once; Telethon and the downloads-tree scan are the slow parts.
+# /api requests wait for them in wait_for_services().
+telegram_service = None
+storage_manager = None
+download_service = None
+services_ready: Optional[asyncio.Event] = None  # Created on startup, inside the server's loop
+services_error: Optional[str] = None
+
+
+def build_services():
+    """Import the Telegram-backed modules and build the services (blocking)."""
+    global telegram_service, storage_manager, download_service
+    from telegram_service import TelegramService
+    from download_service import DownloadService
+    from storage_manager import StorageManager
+    from thumbnail_cache import ThumbnailCache
+    from prefetcher import Prefetcher
+    from postprocess import PostProcessor
+    from bandwidth import BandwidthShaper
+    
+    # API credentials now come from user input
+    telegram_service = TelegramService(session_backend=os.getenv("SESSION_BACKEND", "sqlite"))
+    
+    # Disk quotas for the downloads directory (0 disables a limit)
+    storage_manager = StorageManager(
+        "downloads",
+        global_quota_bytes=int(os.getenv("STORAGE_GLOBAL_QUOTA_BYTES", "0")),
+        session_quota_bytes=int(os.getenv("STORAGE_SESSION_QUOTA_BYTES", "0")),
+        file_ttl_seconds=int(os.getenv("STORAGE_FILE_TTL_SECONDS", "0"))
+    )
+    storage_manager.scan()
+    
+    # Preview thumbnails cached in memory and under downloads/.thumbnails
+    thumbnail_cache = ThumbnailCache(
+        os.path.join("downloads", ".thumbnails"),
+        memory_limit_bytes=int(os.getenv("THUMBNAIL_MEMORY_CACHE_BYTES", str(32 * 1024 * 1024))),
+        disk_limit_bytes=int(os.getenv("THUMBNAIL_DISK_CACHE_BYTES", str(512 * 1024 * 1024)))
+    )
+    # Opt-in speculative prefetch of likely-next files after a listing
+    prefetcher = Prefetcher(
+        policy=os.getenv("PREFETCH_POLICY", "none"),
+        top_n=int(os.getenv("PREFETCH_TOP_N", "5")),
+        budget_bytes=int(os.getenv("PREFETCH_BUDGET_BYTES", str(50 * 1024 * 1024)))
+    )
+    # Archive extraction, recompression etc. run in worker processes
+    postprocessor = PostProcessor(
+        max_workers=int(os.getenv("POSTPROCESS_WORKERS", "2")),
+        max_pending=int(os.getenv("POSTPROCESS_MAX_PENDING", "4"))
+    )
+    # Download rate limits in bytes per second (0 disables a limit)
+    bandwidth = BandwidthShaper(
+        global_rate=int(os.getenv("BANDWIDTH_GLOBAL_BYTES_PER_SEC", "0")),
+        session_rate=int(os.getenv("BANDWIDTH_SESSION_BYTES_PER_SEC", "0")),
+        interactive_reserve=int(os.getenv("BANDWIDTH_INTERACTIVE_RESERVE_BYTES_PER_SEC", "0"))
+    )
+    download_service = DownloadService(
+        storage=storage_manager,
+        thumbnails=thumbnail_cache,
+        prefetcher=prefetcher,
+        postprocessor=postprocessor,
+        bandwidth=bandwidth
+    )
+
+
+async def load_services():
+    """Build services off the event loop, then start background jobs (runs in background)."""
+    global services_error
+    started = time.perf_counter()
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, build_services)
+    except Exception as e:
+        services_error = str(e)
+        print(f"Failed to start services: {e}")
+        return
+    finally:
+        services_ready.set()
+    print(f"Services ready in {time.perf_counter() - started:.2f}s")
+    
+    # Expire old downloads in the background
+    if storage_manager.file_ttl_seconds:
+        interval = int(os.getenv("STORAGE_JANITOR_INTERVAL_SECONDS", "300"))
+        asyncio.create_task(storage_manager.run_janitor(interval))
+    
+    # Write in-memory Telegram session state in batches
+    if telegram_service.session_store is not None:
+        interval = float(os.getenv("SESSION_FLUSH_INTERVAL_SECONDS", "5"))
+        asyncio.create_task(telegram_service.session_store.run_flusher(interval))
+    
+    # Pre-connect recently active sessions so their first request is fast
+    warmup_count = int(os.getenv("SESSION_WARMUP_COUNT", "10"))
+    if warmup_count > 0:
+        asyncio.create_task(telegram_service.warm_up(warmup_count))
+
+
+# Largest number of previews served by one batch request
+MAX_PREVIEW_BATCH = 100
+
+# Bearer token for /api/admin endpoints; they are disabled when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Per-request traces and the slow-operation log
+tracer.configure(
+    slow_threshold=int(os.getenv("SLOW_OPERATION_MS", "1000")) / 1000,
+    history=int(os.getenv("TRACE_HISTORY", "100"))
+)
+# Event-loop lag over the threshold is logged with the blocking stack (0 disables)
+loop_monitor = LoopMonitor(tracer, threshold=int(os.getenv("LOOP_LAG_THRESHOLD_MS", "100")) / 1000)
+# On-demand sampling profiler, started through /api/admin/profile
+profiler = SamplingProfiler()
 
 # Mount downloads directory for file serving
 downloads_path = os.path.join(os.path.dirname(__file__), "downloads")
@@ -54,6 +169,84 @@ def get_token(authorization: str = Header(None)) -> str:
     return authorization.replace("Bearer ", "")
 
 
+def require_admin(token: str = Depends(get_token)) -> str:
+    """Allow only the admin token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    return token
+
+
+def serve_file(request: Request, file_path: str, filename: str) -> Response:
+    """
+    Serve a downloaded file with Range and conditional GET support, using
+    its sha256 as ETag when known.
+    """
+    stat_result = storage_manager.stat(file_path)
+    if stat_result is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    sha256 = download_service.checksums.get_sha256(file_path)
+    return RangeFileResponse(
+        file_path,
+        stat_result,
+        request.headers,
+        filename,
+        etag=f'"{sha256}"' if sha256 else None,
+        method=request.method
+    )
+
+
+@app.on_event("startup")
+async def start_services():
+    global services_ready
+    services_ready = asyncio.Event()
+    asyncio.create_task(load_services())
+    if loop_monitor.threshold > 0:
+        asyncio.create_task(loop_monitor.run())
+
+
+@app.on_event("shutdown")
+async def stop_services():
+    if download_service is not None:
+        download_service.postprocessor.shutdown()
+    if telegram_service is not None and telegram_service.session_store is not None:
+        await telegram_service.session_store.flush()
+
+
+@app.middleware("http")
+async def wait_for_services(request: Request, call_next):
+    """Hold /api requests that arrive while services are still loading."""
+    if request.url.path.startswith("/api/"):
+        await services_ready.wait()
+        if services_error:
+            return JSONResponse(status_code=503, content={"detail": f"Service unavailable: {services_error}"})
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Record a trace for each API request; admin endpoints are left out.
+    The trace stays open until the body is sent, so streamed responses
+    (e.g. channel exports) keep adding spans to it.
+    """
+    path = request.url.path
+    if not path.startswith("/api/") or path.startswith("/api/admin/"):
+        return await call_next(request)
+    trace = Trace(f"{request.method} {path}")
+    token = tracer.current.set(trace)
+    try:
+        response = await call_next(request)
+    except BaseException:
+        tracer.finish(trace)
+        raise
+    finally:
+        tracer.current.reset(token)
+    response.body_iterator = tracer.finish_after(trace, response.body_iterator)
+    return response
+
+
 @app.get("/")
 async def root():
     return {"message": "Telegram Channel Downloader API"}
@@ -116,8 +309,38 @@ async def start_download(request: StartDownloadRequest, token: str = Depends(get
         if not session_id:
             raise HTTPException(status_code=401, detail="Session not found")
         
-        # Start download
-        download_id = await download_service.start_download(client, channel_id, session_id)
+        # Start download, or a live mirror when watching
+        if request.watch:
+            download_id = await download_service.start_watch(
+                client, channel_id, session_id, post_process=request.post_process
+            )
+            return StartDownloadResponse(
+                download_id=download_id,
+                status="watching",
+                message="Channel mirror started successfully"
+            )
+        
+        # Other accounts that can see the channel share the download
+        extra_clients = []
+        shard_sessions = {session_id}
+        for shard_token in request.shard_tokens:
+            shard_session_id = telegram_service.authenticated_sessions.get(shard_token)
+            shard_client = telegram_service.get_client(shard_token)
+            if not shard_client or shard_session_id in shard_sessions:
+                continue
+            try:
+                await telegram_service.ensure_connected(shard_client)
+                shard_channel_id = await download_service.resolve_channel_id(shard_client, channel_info)
+            except ValueError:
+                continue
+            if shard_channel_id == channel_id:
+                extra_clients.append(shard_client)
+                shard_sessions.add(shard_session_id)
+        
+        download_id = await download_service.start_download(
+            client, channel_id, session_id, extra_clients=extra_clients,
+            post_process=request.post_process
+        )
         
         return StartDownloadResponse(
             download_id=download_id,
@@ -133,8 +356,17 @@ async def start_download(request: StartDownloadRequest, token: str = Depends(get
 
 
 @app.get("/api/download/status/{download_id}", response_model=DownloadStatusResponse)
-async def get_download_status(download_id: str, token: str = Depends(get_token)):
-    """Get download status and progress."""
+async def get_download_status(
+    download_id: str,
+    since: int = Query(0, ge=0),
+    summary: bool = False,
+    token: str = Depends(get_token)
+):
+    """
+    Get download status and progress.
+    Only files completed after the `since` cursor are returned; `summary`
+    omits the file list entirely.
+    """
     state = download_service.get_download_status(download_id)
     if not state:
         raise HTTPException(status_code=404, detail="Download not found")
@@ -144,18 +376,37 @@ async def get_download_status(download_id: str, token: str = Depends(get_token))
     if not session_id or state.session_id != session_id:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    from models import FileInfo, DownloadStatus as DownloadStatusEnum
+    # Rows are built by the service, so skip per-item FileInfo validation
+    return FastJSONResponse({
+        "download_id": state.download_id,
+        "status": state.status,
+        "progress": state.progress,
+        "total_files": state.total_files,
+        "downloaded_files": state.downloaded_files,
+        "files": [] if summary else download_service.file_rows(state, since),
+        "cursor": len(state.files),
+        "current_file": state.current_file,
+        "error": state.error,
+        "bandwidth": download_service.bandwidth.describe(state.session_id)
+    })
+
+
+@app.post("/api/download/watch/{download_id}/stop")
+async def stop_watch(download_id: str, token: str = Depends(get_token)):
+    """Stop a live channel mirror."""
+    state = download_service.get_download_status(download_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="Download not found")
     
-    return DownloadStatusResponse(
-        download_id=state.download_id,
-        status=DownloadStatusEnum(state.status),
-        progress=state.progress,
-        total_files=state.total_files,
-        downloaded_files=state.downloaded_files,
-        files=[FileInfo(**f) for f in state.files],
-        current_file=state.current_file,
-        error=state.error
-    )
+    # Verify token matches session
+    session_id = telegram_service.authenticated_sessions.get(token)
+    if not session_id or state.session_id != session_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    if not await download_service.stop_watch(download_id):
+        raise HTTPException(status_code=400, detail="Download is not a running mirror")
+    
+    return {"download_id": download_id, "status": state.status}
 
 
 @app.post("/api/channel/list", response_model=ListChannelFilesResponse)
@@ -183,11 +434,51 @@ async def list_channel_files(request: ListChannelFilesRequest, token: str = Depe
         # List files
         files_data = await download_service.list_channel_files(client, channel_id)
         
-        return ListChannelFilesResponse(
-            channel_id=channel_id,
-            channel_name=channel_name,
-            files=[ChannelFileInfo(**f) for f in files_data],
-            total_count=len(files_data)
+        session_id = telegram_service.authenticated_sessions.get(token)
+        if session_id:
+            download_service.schedule_prefetch(client, channel_id, session_id, files_data)
+        
+        # Rows are built by the service, so skip per-item ChannelFileInfo validation
+        return FastJSONResponse({
+            "channel_id": channel_id,
+            "channel_name": channel_name,
+            "files": files_data,
+            "total_count": len(files_data)
+        })
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@app.post("/api/channel/export")
+async def export_channel_files(request: ExportChannelRequest, token: str = Depends(get_token)):
+    """Stream a channel's file listing as NDJSON, CSV or Parquet."""
+    try:
+        if request.format not in MANIFEST_FORMATS:
+            raise ValueError(f"Unknown export format '{request.format}'. Use one of: {', '.join(MANIFEST_FORMATS)}")
+        if request.format == "parquet" and not parquet_available():
+            raise ValueError("Parquet export needs pyarrow, which is not installed")
+        
+        # Get authenticated client
+        client = telegram_service.get_client(token)
+        if not client:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+        
+        await telegram_service.ensure_connected(client)
+        
+        # Resolving the channel also checks this account can see it
+        channel_info = download_service.parse_channel_input(request.channel)
+        channel_id = await download_service.resolve_channel_id(client, channel_info)
+        
+        media_type, extension = MANIFEST_FORMATS[request.format]
+        rows = download_service.iter_channel_files(client, channel_id, refresh=request.refresh)
+        return StreamingResponse(
+            ENCODERS[request.format](rows),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="channel_{channel_id}.{extension}"'}
         )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -225,12 +516,12 @@ async def download_all_files(
             client, channel_id, request.message_ids, session_id
         )
         
-        return {
+        return FastJSONResponse({
             "success": True,
             "total_requested": len(request.message_ids),
             "total_downloaded": len([f for f in downloaded_files if f.get("success")]),
             "files": downloaded_files
-        }
+        })
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except HTTPException:
@@ -243,6 +534,7 @@ async def download_all_files(
 async def download_single_file(
     message_id: int,
     request: ListChannelFilesRequest,
+    http_request: Request,
     token: str = Depends(get_token)
 ):
     """Download a specific file by message ID from a channel."""
@@ -268,15 +560,123 @@ async def download_single_file(
             client, channel_id, message_id, session_id
         )
         
-        if not file_path or not os.path.exists(file_path):
+        if not file_path:
             raise HTTPException(status_code=404, detail="File not found")
         
         filename = os.path.basename(file_path)
         
-        return FileResponse(
-            file_path,
-            filename=filename,
-            media_type="application/octet-stream"
+        return serve_file(http_request, file_path, filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@app.get("/api/storage/usage")
+async def get_storage_usage(token: str = Depends(get_token)):
+    """Get disk usage and quotas for the current session."""
+    session_id = telegram_service.authenticated_sessions.get(token)
+    if not session_id:
+        raise HTTPException(status_code=401, detail="Session not found")
+    return storage_manager.get_usage(session_id)
+
+
+@app.get("/api/admin/bandwidth")
+async def get_bandwidth(token: str = Depends(require_admin)):
+    """Get download rate limits and current throughput per session."""
+    return download_service.bandwidth.describe()
+
+
+@app.post("/api/admin/bandwidth")
+async def set_bandwidth(request: BandwidthConfigRequest, token: str = Depends(require_admin)):
+    """Change download rate limits; takes effect for transfers already running."""
+    bandwidth = download_service.bandwidth
+    try:
+        bandwidth.configure(
+            global_rate=request.global_limit,
+            session_rate=request.session_limit,
+            interactive_reserve=request.interactive_reserve
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for session_id, limit in request.session_overrides.items():
+        bandwidth.set_session_rate(session_id, limit)
+    return bandwidth.describe()
+
+
+@app.post("/api/admin/profile")
+async def start_profile(request: ProfileRequest, token: str = Depends(require_admin)):
+    """Sample stacks for a time window; fetch the result with GET /api/admin/profile."""
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    # Endpoints run on the event loop thread
+    thread_ids = None if request.all_threads else [threading.get_ident()]
+    try:
+        profiler.start(request.seconds, request.interval_ms / 1000, thread_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return profiler.describe()
+
+
+@app.get("/api/admin/profile")
+async def get_profile(token: str = Depends(require_admin)):
+    """Last profile as collapsed stacks, for flamegraph.pl or speedscope."""
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="Profile is still running")
+    if not profiler.samples:
+        raise HTTPException(status_code=404, detail="No profile recorded")
+    return Response(content=profiler.dump(), media_type="text/plain")
+
+
+@app.get("/api/admin/traces")
+async def get_traces(
+    limit: int = Query(20, ge=1, le=1000),
+    min_ms: float = Query(0, ge=0),
+    token: str = Depends(require_admin)
+):
+    """Recent request and download traces with their spans, newest first."""
+    return FastJSONResponse(content={"traces": tracer.recent_traces(limit, min_ms / 1000)})
+
+
+@app.get("/api/admin/slow")
+async def get_slow_operations(token: str = Depends(require_admin)):
+    """Slow-operation log, newest first, and event-loop lag."""
+    return FastJSONResponse(content={
+        "slow_operations": list(reversed(tracer.slow_log)),
+        "event_loop": loop_monitor.describe()
+    })
+
+
+@app.post("/api/file/preview/{message_id}")
+async def get_file_preview(
+    message_id: int,
+    request: ListChannelFilesRequest,
+    token: str = Depends(get_token)
+):
+    """Get the smallest thumbnail of a file as a JPEG."""
+    try:
+        # Get authenticated client
+        client = telegram_service.get_client(token)
+        if not client:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+        
+        await telegram_service.ensure_connected(client)
+        
+        # Parse channel input
+        channel_info = download_service.parse_channel_input(request.channel)
+        channel_id = await download_service.resolve_channel_id(client, channel_info)
+        
+        previews = await download_service.get_thumbnails(client, channel_id, [message_id])
+        data = previews.get(message_id)
+        if not data:
+            raise HTTPException(status_code=404, detail="No preview available")
+        
+        return Response(
+            content=data,
+            media_type="image/jpeg",
+            headers={"Cache-Control": "private, max-age=86400"}
         )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -286,8 +686,47 @@ async def download_single_file(
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
-@app.get("/api/download/files/{download_id}/{filename}")
-async def download_file(download_id: str, filename: str, token: str = Depends(get_token)):
+@app.post("/api/file/previews")
+async def get_file_previews(request: PreviewBatchRequest, token: str = Depends(get_token)):
+    """Get thumbnails for a page of files as base64 JPEGs (null where unavailable)."""
+    if len(request.message_ids) > MAX_PREVIEW_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PREVIEW_BATCH} previews per request")
+    try:
+        # Get authenticated client
+        client = telegram_service.get_client(token)
+        if not client:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+        
+        await telegram_service.ensure_connected(client)
+        
+        # Parse channel input
+        channel_info = download_service.parse_channel_input(request.channel)
+        channel_id = await download_service.resolve_channel_id(client, channel_info)
+        
+        previews = await download_service.get_thumbnails(client, channel_id, request.message_ids)
+        
+        return FastJSONResponse({
+            "mime_type": "image/jpeg",
+            "previews": {
+                str(message_id): base64.b64encode(data).decode("ascii") if data else None
+                for message_id, data in previews.items()
+            }
+        })
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@app.get("/api/download/files/{download_id}/{filename:path}")
+async def download_file(
+    download_id: str,
+    filename: str,
+    request: Request,
+    token: str = Depends(get_token)
+):
     """Download a specific file."""
     state = download_service.get_download_status(download_id)
     if not state:
@@ -302,11 +741,7 @@ async def download_file(download_id: str, filename: str, token: str = Depends(ge
     if not file_path:
         raise HTTPException(status_code=404, detail="File not found")
     
-    return FileResponse(
-        file_path,
-        filename=filename,
-        media_type="application/octet-stream"
-    )
+    return serve_file(request, file_path, os.path.basename(filename))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,208 @@
+import os
+import io
+import csv
+import json
+from typing import AsyncGenerator, AsyncIterator, Dict, Iterator, List
+
+from responses import orjson
+
+
+# Columns of an exported manifest, in ChannelFileInfo order
+MANIFEST_FIELDS = ("message_id", "filename", "size", "mime_type", "date", "is_video", "is_photo")
+
+# Export format -> (media type, file extension)
+MANIFEST_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# Rows encoded per chunk of a streamed NDJSON/CSV export
+EXPORT_BATCH_SIZE = 1000
+
+# Rows per Parquet row group; bounds export memory
+PARQUET_ROW_GROUP_SIZE = 10000
+
+
+def _dumps(row: Dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(row)
+    return json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class ChannelIndex:
+    """
+    Local index of channel listings: one NDJSON file of ChannelFileInfo rows
+    per channel, oldest message first. Rows are read back one line at a
+    time, so using the index costs the same memory for any channel size.
+    """
+
+    def __init__(self, index_dir: str = "index"):
+        self.index_dir = index_dir
+        os.makedirs(index_dir, exist_ok=True)
+
+    def _get_path(self, channel_id: int) -> str:
+        return os.path.join(self.index_dir, f"{channel_id}.ndjson")
+
+    def exists(self, channel_id: int) -> bool:
+        return os.path.exists(self._get_path(channel_id))
+
+    def read(self, channel_id: int) -> Iterator[Dict]:
+        """Yield a channel's indexed rows."""
+        try:
+            f = open(self._get_path(channel_id), 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Torn last line from an interrupted append
+                    return
+
+    def writer(self, channel_id: int, rebuild: bool = False) -> "IndexWriter":
+        """Append rows to a channel's index, or replace it when rebuild is set."""
+        return IndexWriter(self._get_path(channel_id), rebuild)
+
+
+class IndexWriter:
+    """Writes index rows; a rebuild only replaces the old index on commit()."""
+
+    def __init__(self, path: str, rebuild: bool):
+        self.path = path
+        self.rebuild = rebuild
+        self._write_path = path + ".tmp" if rebuild else path
+        self._file = open(self._write_path, 'wb' if rebuild else 'ab')
+
+    def write(self, row: Dict):
+        self._file.write(_dumps(row) + b"\n")
+
+    def commit(self):
+        self._file.close()
+        if self.rebuild:
+            os.replace(self._write_path, self.path)
+
+    def abort(self):
+        """Keep appended rows (each is a whole line), drop an unfinished rebuild."""
+        self._file.close()
+        if self.rebuild:
+            try:
+                os.remove(self._write_path)
+            except OSError:
+                pass
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+async def _batches(rows: AsyncGenerator[Dict, None], size: int) -> AsyncIterator[List[Dict]]:
+    batch = []
+    try:
+        async for row in rows:
+            batch.append(row)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    finally:
+        # Close the source now if the client went away mid-stream
+        await rows.aclose()
+    if batch:
+        yield batch
+
+
+async def encode_ndjson(rows: AsyncGenerator[Dict, None]) -> AsyncIterator[bytes]:
+    batches = _batches(rows, EXPORT_BATCH_SIZE)
+    try:
+        async for batch in batches:
+            yield b"".join(_dumps(row) + b"\n" for row in batch)
+    finally:
+        await batches.aclose()
+
+
+async def encode_csv(rows: AsyncGenerator[Dict, None]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, MANIFEST_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    batches = _batches(rows, EXPORT_BATCH_SIZE)
+    try:
+        async for batch in batches:
+            writer.writerows(batch)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    finally:
+        await batches.aclose()
+    if buffer.tell():
+        # Header only: the channel has no files
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink:
+    """File-like target for ParquetWriter that hands back what was written so far."""
+
+    def __init__(self):
+        self.closed = False
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def encode_parquet(rows: AsyncGenerator[Dict, None]) -> AsyncIterator[bytes]:
+    """Write rows as Parquet, one row group at a time; needs pyarrow."""
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema([
+        ("message_id", pyarrow.int64()),
+        ("filename", pyarrow.string()),
+        ("size", pyarrow.int64()),
+        ("mime_type", pyarrow.string()),
+        ("date", pyarrow.string()),
+        ("is_video", pyarrow.bool_()),
+        ("is_photo", pyarrow.bool_()),
+    ])
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    batches = _batches(rows, PARQUET_ROW_GROUP_SIZE)
+    try:
+        async for batch in batches:
+            table = pyarrow.Table.from_pylist(batch, schema=schema)
+            writer.write_table(table, row_group_size=len(batch))
+            yield sink.drain()
+    finally:
+        await batches.aclose()
+        writer.close()
+    # Footer
+    yield sink.drain()
+
+
+ENCODERS = {
+    "ndjson": encode_ndjson,
+    "csv": encode_csv,
+    "parquet": encode_parquet,
+}
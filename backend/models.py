@@ -33,10 +33,14 @@ class DownloadStatus(str, Enum):
     IN_PROGRESS = "in_progress"
     COMPLETED = "completed"
     FAILED = "failed"
+    WATCHING = "watching"  # Live mirror following new channel posts
 
 
 class StartDownloadRequest(BaseModel):
     channel: str  # Can be channel link, @username, or channel ID
+    watch: bool = False  # Keep mirroring new posts after catching up
+    shard_tokens: List[str] = []  # Tokens of other signed-in accounts to share the work with
+    post_process: List[str] = []  # Steps run on each downloaded file, e.g. ["extract_archive", "metadata"]
 
 
 class StartDownloadResponse(BaseModel):
@@ -49,7 +53,10 @@ class FileInfo(BaseModel):
     filename: str
     size: int
     path: str
-    download_url: str
+    download_url: Optional[str] = None  # None once the file was evicted
+    sha256: Optional[str] = None  # Computed while the file was downloaded
+    evicted: bool = False  # Removed by quota eviction or TTL expiry
+    post_process: Optional[Dict] = None  # Post-processing status, steps and outputs
 
 
 class DownloadStatusResponse(BaseModel):
@@ -58,9 +65,11 @@ class DownloadStatusResponse(BaseModel):
     progress: float  # 0-100
     total_files: int
     downloaded_files: int
-    files: List[FileInfo]
+    files: List[FileInfo]  # Only files after the `since` cursor, empty in summary mode
+    cursor: int = 0  # Pass as `since` on the next poll to get only newer files
     current_file: Optional[str] = None
     error: Optional[str] = None
+    bandwidth: Optional[Dict] = None  # Rate limits (bytes/s, 0 = unlimited) and the session's current rate
 
 
 class ChannelFileInfo(BaseModel):
@@ -77,6 +86,12 @@ class ListChannelFilesRequest(BaseModel):
     channel: str  # Can be channel link, @username, or channel ID
 
 
+class ExportChannelRequest(BaseModel):
+    channel: str  # Can be channel link, @username, or channel ID
+    format: str = "ndjson"  # ndjson, csv or parquet
+    refresh: bool = False  # Re-read the whole channel instead of using the local index
+
+
 class ListChannelFilesResponse(BaseModel):
     channel_id: int
     channel_name: Optional[str] = None
@@ -88,3 +103,21 @@ class DownloadAllRequest(BaseModel):
     channel: str
     message_ids: List[int]  # List of message IDs to download
 
+
+class PreviewBatchRequest(BaseModel):
+    channel: str
+    message_ids: List[int]  # Up to MAX_PREVIEW_BATCH message IDs
+
+
+class BandwidthConfigRequest(BaseModel):
+    # Bytes per second, 0 = unlimited; fields left out keep their value
+    global_limit: Optional[int] = None
+    session_limit: Optional[int] = None  # Default for every session
+    interactive_reserve: Optional[int] = None  # Share of global_limit kept for single-file downloads
+    session_overrides: Dict[str, Optional[int]] = {}  # session_id -> limit, null removes the override
+
+
+class ProfileRequest(BaseModel):
+    seconds: float = 30  # Sampling window, up to MAX_PROFILE_SECONDS
+    interval_ms: float = 10  # Time between stack samples
+    all_threads: bool = False  # Also sample worker threads, not only the event loop
@@ -0,0 +1,180 @@
+import os
+import shutil
+import tarfile
+import zipfile
+import asyncio
+import mimetypes
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional
+
+
+# Post-processing steps run in worker processes. Each takes the path of a
+# downloaded file and returns {"outputs": [paths], "metadata": {...}}.
+# They must be module-level functions so they can be pickled.
+
+
+def _safe_extract_tar(archive: tarfile.TarFile, target: str):
+    """Extract a tar archive, refusing members that would land outside target."""
+    root = os.path.realpath(target)
+    for member in archive.getmembers():
+        dest = os.path.realpath(os.path.join(root, member.name))
+        if os.path.commonpath([root, dest]) != root or member.issym() or member.islnk() or member.isdev():
+            raise RuntimeError(f"Unsafe archive member: {member.name}")
+    archive.extractall(root)
+
+
+def extract_archive(path: str) -> Dict:
+    """Unpack a zip/tar archive next to it, into <name>_extracted/."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    target = os.path.join(os.path.dirname(path), f"{stem}_extracted")
+    if tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            _safe_extract_tar(archive, target)
+    elif zipfile.is_zipfile(path):
+        # unpack_archive skips absolute and ".." member names in zips
+        shutil.unpack_archive(path, target, "zip")
+    else:
+        return {"outputs": [], "metadata": {"skipped": "not an archive"}}
+
+    outputs = []
+    for root, _, filenames in os.walk(target):
+        outputs.extend(os.path.join(root, name) for name in filenames)
+    return {"outputs": outputs, "metadata": {"extracted_files": len(outputs)}}
+
+
+def recompress_image(path: str) -> Dict:
+    """Re-encode an image as an optimized JPEG, <name>.min.jpg."""
+    try:
+        from PIL import Image
+    except ImportError:
+        raise RuntimeError("Pillow is not installed")
+
+    mime_type = mimetypes.guess_type(path)[0] or ""
+    if not mime_type.startswith("image/"):
+        return {"outputs": [], "metadata": {"skipped": "not an image"}}
+
+    output = os.path.splitext(path)[0] + ".min.jpg"
+    with Image.open(path) as image:
+        image.convert("RGB").save(output, "JPEG", quality=85, optimize=True)
+    return {
+        "outputs": [output],
+        "metadata": {"original_size": os.path.getsize(path), "compressed_size": os.path.getsize(output)}
+    }
+
+
+def remux_video(path: str) -> Dict:
+    """Remux a video into an MP4 container without re-encoding, <name>.remux.mp4."""
+    if not shutil.which("ffmpeg"):
+        raise RuntimeError("ffmpeg is not installed")
+
+    mime_type = mimetypes.guess_type(path)[0] or ""
+    if not mime_type.startswith("video/"):
+        return {"outputs": [], "metadata": {"skipped": "not a video"}}
+
+    output = os.path.splitext(path)[0] + ".remux.mp4"
+    result = subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-i", path, "-c", "copy", "-movflags", "+faststart", output],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[:200]}")
+    return {"outputs": [output], "metadata": {}}
+
+
+def extract_metadata(path: str) -> Dict:
+    """Collect basic file metadata, plus image dimensions when Pillow is available."""
+    metadata = {
+        "size": os.path.getsize(path),
+        "mime_type": mimetypes.guess_type(path)[0],
+    }
+    if (metadata["mime_type"] or "").startswith("image/"):
+        try:
+            from PIL import Image
+            with Image.open(path) as image:
+                metadata["width"], metadata["height"] = image.size
+        except ImportError:
+            pass
+    return {"outputs": [], "metadata": metadata}
+
+
+PROCESSORS: Dict[str, Callable[[str], Dict]] = {
+    "extract_archive": extract_archive,
+    "recompress_image": recompress_image,
+    "remux_video": remux_video,
+    "metadata": extract_metadata,
+}
+
+
+def _run_steps(path: str, steps: List[str]) -> Dict:
+    """Run a job's steps on one file inside a worker process."""
+    results = {}
+    for step in steps:
+        try:
+            results[step] = PROCESSORS[step](path)
+        except Exception as e:
+            results[step] = {"error": str(e)}
+    return results
+
+
+class PostProcessor:
+    """
+    Runs post-processing steps on downloaded files in a process pool.
+
+    At most max_pending files are queued or running at once; submit() waits
+    for a slot, which holds back the download loop instead of letting work
+    pile up. The pool is created on first use, with forkserver workers since
+    the service already runs threads; a pool broken by a killed worker is
+    replaced on the next submit.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 4):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @staticmethod
+    def validate_steps(steps: List[str]):
+        unknown = [step for step in steps if step not in PROCESSORS]
+        if unknown:
+            raise ValueError(
+                f"Unknown post-processing step(s): {', '.join(unknown)}. "
+                f"Available: {', '.join(PROCESSORS)}"
+            )
+
+    async def submit(self, path: str, steps: List[str]) -> "asyncio.Future":
+        """
+        Queue a file for processing once a slot is free.
+        Returns a future resolving to {step: result} for the file.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+
+        await self._slots.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("forkserver")
+                )
+            future = loop.run_in_executor(self._executor, _run_steps, path, steps)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool for later files
+            self._slots.release()
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            raise
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,103 @@
+import asyncio
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from profiling import tracer
+
+
+PREFETCH_POLICIES = ("none", "newest", "smallest", "popular")
+
+
+class Prefetcher:
+    """
+    Speculatively downloads files a user is likely to open after a listing.
+
+    Candidates are picked by a policy (newest, smallest, or most requested
+    across sessions), capped at top_n files and budget_bytes in total.
+    Only one prefetch runs at a time, one file at a time, and only while no
+    user-initiated transfer is active: starting a foreground transfer
+    cancels it immediately. The default policy "none" disables prefetching.
+    """
+
+    def __init__(self, policy: str = "none", top_n: int = 5, budget_bytes: int = 50 * 1024 * 1024):
+        if policy not in PREFETCH_POLICIES:
+            raise ValueError(f"Unknown prefetch policy '{policy}'. Use one of: {', '.join(PREFETCH_POLICIES)}")
+        self.policy = policy
+        self.top_n = top_n
+        self.budget_bytes = budget_bytes
+
+        self.request_counts: Counter = Counter()  # (channel_id, message_id) -> user requests
+        self.foreground = 0  # Active user-initiated transfers
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.policy != "none" and self.top_n > 0 and self.budget_bytes > 0
+
+    def record_request(self, channel_id: int, message_id: int):
+        """Count a user request for a file, for the "popular" policy."""
+        self.request_counts[(channel_id, message_id)] += 1
+
+    def select_candidates(
+        self,
+        channel_id: int,
+        files: List[Dict],
+        is_cached: Callable[[int], bool]
+    ) -> List[Dict]:
+        """Pick which listed files to prefetch, within the count and size budget."""
+        if self.policy == "newest":
+            ranked = sorted(files, key=lambda f: f["message_id"], reverse=True)
+        elif self.policy == "smallest":
+            ranked = sorted(files, key=lambda f: f["size"])
+        elif self.policy == "popular":
+            counts = self.request_counts
+            ranked = [f for f in files if counts[(channel_id, f["message_id"])]]
+            ranked.sort(key=lambda f: counts[(channel_id, f["message_id"])], reverse=True)
+        else:
+            return []
+
+        selected = []
+        remaining = self.budget_bytes
+        for file_info in ranked:
+            if len(selected) >= self.top_n:
+                break
+            if file_info["size"] > remaining or is_cached(file_info["message_id"]):
+                continue
+            selected.append(file_info)
+            remaining -= file_info["size"]
+        return selected
+
+    def schedule(self, fetch: Callable[[Dict], Awaitable], candidates: List[Dict]):
+        """Replace any running prefetch with one for these candidates."""
+        self.cancel()
+        if not candidates or self.foreground:
+            return
+        self.task = asyncio.create_task(self._run(fetch, candidates))
+
+    async def _run(self, fetch: Callable[[Dict], Awaitable], candidates: List[Dict]):
+        """Fetch candidates one by one (runs in background)."""
+        # Own trace, not the listing request's that scheduled it
+        with tracer.start_trace("prefetch"):
+            for file_info in candidates:
+                if self.foreground:
+                    return
+                try:
+                    await fetch(file_info)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Prefetch of message {file_info['message_id']} failed: {e}")
+
+    def cancel(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+        self.task = None
+
+    def foreground_started(self):
+        """A user-initiated transfer needs the bandwidth: stop prefetching."""
+        self.foreground += 1
+        self.cancel()
+
+    def foreground_finished(self):
+        self.foreground -= 1
+
@@ -0,0 +1,300 @@
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+
+# Spans kept per trace; later ones are only counted
+MAX_SPANS_PER_TRACE = 1000
+
+# Longest sampling profile that can be requested, in seconds
+MAX_PROFILE_SECONDS = 300
+
+# Stack frames kept when the event loop is caught blocked
+BLOCKED_STACK_DEPTH = 15
+
+
+class Trace:
+    """Timed spans of one request or download job."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: List[Dict] = []
+        self.dropped_spans = 0
+
+    def add_span(self, name: str, start: float, duration: float, attrs: Dict):
+        if len(self.spans) >= MAX_SPANS_PER_TRACE:
+            self.dropped_spans += 1
+            return
+        span = {
+            "name": name,
+            "start_ms": round((start - self.start) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3)
+        }
+        span.update(attrs)
+        self.spans.append(span)
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "spans": self.spans,
+            "dropped_spans": self.dropped_spans
+        }
+
+
+class Tracer:
+    """
+    Per-request traces and the slow-operation log.
+
+    The current trace follows the asyncio context, so spans opened anywhere
+    below a request (or a download job) land in its trace. Spans and traces
+    slower than slow_threshold are also added to the slow-operation log.
+    """
+
+    def __init__(self, slow_threshold: float = 1.0, history: int = 100):
+        self.slow_threshold = slow_threshold
+        self.current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+        self.traces: deque = deque(maxlen=history)
+        self.slow_log: deque = deque(maxlen=200)
+
+    def configure(self, slow_threshold: Optional[float] = None, history: Optional[int] = None):
+        if slow_threshold is not None:
+            self.slow_threshold = slow_threshold
+        if history is not None:
+            self.traces = deque(self.traces, maxlen=history)
+
+    @contextmanager
+    def start_trace(self, name: str) -> Iterator[Trace]:
+        """Make a new trace current for the enclosed code, then keep it in the history."""
+        trace = Trace(name)
+        token = self.current.set(trace)
+        try:
+            yield trace
+        finally:
+            self.current.reset(token)
+            self.finish(trace)
+
+    def finish(self, trace: Trace):
+        """Close a trace and keep it in the history."""
+        trace.duration = time.perf_counter() - trace.start
+        self.traces.append(trace)
+        if trace.duration >= self.slow_threshold:
+            self.record_slow(trace.name, trace.duration, kind="trace")
+
+    async def finish_after(self, trace: Trace, body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Pass a response body through, finishing the trace once it is sent."""
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            self.finish(trace)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Time the enclosed code as a span of the current trace."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            trace = self.current.get()
+            if trace is not None:
+                trace.add_span(name, start, duration, attrs)
+            if duration >= self.slow_threshold:
+                self.record_slow(name, duration, **attrs)
+
+    async def traced_pages(self, iterator, name: str) -> AsyncIterator:
+        """
+        Pass items through from a Telethon request iterator, recording a span
+        for each page it fetches. Iterators that do not expose their buffer
+        get a span for every item that took noticeable time.
+        """
+        while True:
+            buffer = getattr(iterator, "buffer", ())
+            fetches_page = buffer is None or getattr(iterator, "index", -1) == len(buffer or ())
+            start = time.perf_counter()
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                duration = time.perf_counter() - start
+                if fetches_page or duration >= 0.001:
+                    trace = self.current.get()
+                    if trace is not None:
+                        trace.add_span(name, start, duration, {})
+                    if duration >= self.slow_threshold:
+                        self.record_slow(name, duration)
+            yield item
+
+    def record_slow(self, name: str, duration: float, **attrs):
+        trace = self.current.get()
+        entry = {
+            "name": name,
+            "duration_ms": round(duration * 1000, 3),
+            "at": time.time(),
+            "trace": trace.name if trace else None
+        }
+        entry.update(attrs)
+        self.slow_log.append(entry)
+        print(f"Slow operation: {name} took {duration * 1000:.0f} ms")
+
+    def recent_traces(self, limit: int = 20, min_duration: float = 0.0) -> List[Dict]:
+        """Finished traces, newest first."""
+        result = []
+        for trace in reversed(self.traces):
+            if trace.duration is not None and trace.duration >= min_duration:
+                result.append(trace.to_dict())
+                if len(result) >= limit:
+                    break
+        return result
+
+
+tracer = Tracer()
+
+
+def _format_stack(frame, depth: Optional[int] = None, current_line: bool = True) -> List[str]:
+    """
+    Frames as "function (file:line)", outermost first, keeping the innermost
+    `depth`. Without current_line the line is where the function starts, so
+    samples from anywhere in a function add up.
+    """
+    stack = []
+    while frame is not None and (depth is None or len(stack) < depth):
+        code = frame.f_code
+        line = frame.f_lineno if current_line else code.co_firstlineno
+        stack.append(f"{code.co_name} ({code.co_filename}:{line})")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler that samples thread stacks from a background thread.
+
+    Runs for a fixed window, then keeps the result as collapsed stacks
+    ("frame;frame;frame count" lines), the input format of flamegraph.pl
+    and speedscope. Sampling only reads frames, so the profiled code runs
+    unmodified; cost is one stack walk per interval.
+    """
+
+    def __init__(self):
+        self.running = False
+        self.started_at: Optional[float] = None
+        self.ends_at: Optional[float] = None
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+
+    def start(self, seconds: float, interval: float, thread_ids: Optional[List[int]] = None):
+        """Sample the given threads (all threads if None) for `seconds`."""
+        if self.running:
+            raise ValueError("A profile is already running")
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise ValueError(f"Profile window must be between 0 and {MAX_PROFILE_SECONDS} seconds")
+        if interval <= 0:
+            raise ValueError("Sampling interval must be positive")
+
+        self.running = True
+        self.started_at = time.time()
+        self.ends_at = self.started_at + seconds
+        self.samples = Counter()
+        self.sample_count = 0
+        thread = threading.Thread(
+            target=self._run, args=(seconds, interval, thread_ids), name="profiler", daemon=True
+        )
+        thread.start()
+
+    def _run(self, seconds: float, interval: float, thread_ids: Optional[List[int]]):
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        deadline = time.monotonic() + seconds
+        try:
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id or (thread_ids is not None and thread_id not in thread_ids):
+                        continue
+                    if thread_id not in names:
+                        names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    stack = [names.get(thread_id, str(thread_id))] + _format_stack(frame, current_line=False)
+                    self.samples[";".join(stack)] += 1
+                self.sample_count += 1
+                time.sleep(interval)
+        finally:
+            self.running = False
+
+    def dump(self) -> str:
+        """Collapsed stacks of the last profile, most sampled first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def describe(self) -> Dict:
+        return {
+            "running": self.running,
+            "started_at": self.started_at,
+            "ends_at": self.ends_at,
+            "samples": self.sample_count
+        }
+
+
+class LoopMonitor:
+    """
+    Measures event-loop lag and catches what is blocking the loop.
+
+    A coroutine wakes every interval and notes how late it woke. A watchdog
+    thread checks that heartbeat; when the loop has been stuck for longer
+    than the threshold it grabs the loop thread's stack, which names the
+    callback doing the blocking. Lags over the threshold go to the tracer's
+    slow-operation log together with that stack.
+    """
+
+    def __init__(self, tracer: Tracer, threshold: float = 0.1, interval: float = 0.05):
+        self.tracer = tracer
+        self.threshold = threshold
+        self.interval = interval
+        self.heartbeat = time.monotonic()
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.blocked_count = 0
+        self._loop_thread_id: Optional[int] = None
+        self._blocked_stack: Optional[List[str]] = None
+
+    async def run(self):
+        """Track loop lag (runs in background)."""
+        self._loop_thread_id = threading.get_ident()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        while True:
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - self.heartbeat - self.interval
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self.blocked_count += 1
+                self.tracer.record_slow("event_loop_lag", lag, stack=self._blocked_stack)
+            self._blocked_stack = None
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            stalled = time.monotonic() - self.heartbeat - self.interval
+            if self._blocked_stack is None and stalled >= self.threshold:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    self._blocked_stack = _format_stack(frame, BLOCKED_STACK_DEPTH)
+
+    def describe(self) -> Dict:
+        return {
+            "threshold_ms": round(self.threshold * 1000, 3),
+            "last_lag_ms": round(self.last_lag * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "blocked_count": self.blocked_count
+        }
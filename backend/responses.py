@@ -0,0 +1,168 @@
+import os
+import json
+from email.utils import parsedate_to_datetime
+from typing import Any, Mapping, Optional, Tuple
+
+import anyio
+from fastapi.responses import FileResponse, JSONResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from profiling import tracer
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; fall back to the standard encoder
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response for large payloads the service built itself.
+
+    Returning it from an endpoint bypasses FastAPI's response_model
+    validation and jsonable_encoder pass, so content must already be plain
+    JSON-compatible data. Encodes with orjson when it is installed.
+    """
+
+    def render(self, content: Any) -> bytes:
+        with tracer.span("encode_response"):
+            if orjson is not None:
+                return orjson.dumps(content)
+            return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RangeFileResponse(FileResponse):
+    """
+    File response with conditional GET and single byte-range support.
+
+    Answers 304 when If-None-Match or If-Modified-Since match, 206 for a
+    satisfiable Range (honouring If-Range) and 416 for an unsatisfiable
+    one; multi-range requests get the whole file. The body goes out in
+    chunks read off the event loop.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result,
+        request_headers: Mapping[str, str],
+        filename: str,
+        etag: Optional[str] = None,
+        method: str = "GET"
+    ):
+        size = stat_result.st_size
+        etag = etag or f'"{stat_result.st_mtime_ns:x}-{size:x}"'
+        super().__init__(
+            path,
+            headers={"etag": etag, "accept-ranges": "bytes"},
+            media_type="application/octet-stream",
+            filename=filename,
+            stat_result=stat_result,
+            method=method
+        )
+        last_modified = self.headers["last-modified"]
+        self.start = 0
+        self.length = size
+
+        if _not_modified(request_headers, etag, stat_result.st_mtime):
+            self._headers_only(304)
+            del self.headers["content-length"]
+            return
+
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if not range_header or (if_range and if_range not in (etag, last_modified)):
+            return
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            self._headers_only(416)
+            self.headers["content-range"] = f"bytes */{size}"
+            self.headers["content-length"] = "0"
+            return
+        if byte_range is None:
+            return
+
+        self.start, end = byte_range
+        self.length = end - self.start + 1
+        self.status_code = 206
+        self.headers["content-range"] = f"bytes {self.start}-{end}/{size}"
+        self.headers["content-length"] = str(self.length)
+
+    def _headers_only(self, status_code: int):
+        self.status_code = status_code
+        self.send_header_only = True
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        start_message = {"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers}
+        if self.send_header_only:
+            await send(start_message)
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        try:
+            file = await anyio.open_file(self.path, mode="rb")
+        except OSError:
+            # Removed since it was looked up
+            await Response(status_code=404)(scope, receive, send)
+            return
+
+        async with file:
+            await send(start_message)
+            await file.seek(self.start)
+            remaining = self.length
+            while True:
+                chunk = await file.read(min(self.chunk_size, remaining)) if remaining else b""
+                remaining -= len(chunk)
+                more_body = remaining > 0 and len(chunk) > 0
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                if not more_body:
+                    break
+
+
+def _not_modified(request_headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    """Evaluate If-None-Match, or If-Modified-Since when no ETag was sent."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # Weak comparison: W/"x" matches "x"
+        return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+    return False
+
+
+def _parse_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single "bytes=" range into inclusive (start, end).
+    Returns None for ranges to ignore (malformed or multiple) and raises
+    ValueError when the range cannot be satisfied.
+    """
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    first, last = first.strip(), last.strip()
+    if not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size:
+        raise ValueError("Unsatisfiable range")
+    if start > end:
+        return None
+    return start, min(end, size - 1)
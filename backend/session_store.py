@@ -0,0 +1,382 @@
+import os
+import time
+import sqlite3
+import asyncio
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from telethon import utils
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession
+from telethon.tl import types
+
+
+# How session state is kept: a SQLite .session file per session (Telethon's
+# default), or in memory with batched writes to one shared store
+SESSION_BACKENDS = ("sqlite", "memory")
+
+# Seconds between attempts to write an auth change after a failed write
+DURABLE_RETRY_DELAY = 1
+
+_SCHEMA = """
+create table if not exists sessions (
+    session_id text primary key,
+    dc_id integer,
+    server_address text,
+    port integer,
+    auth_key blob,
+    takeout_id integer,
+    updated_at real
+);
+create table if not exists entities (
+    session_id text,
+    id integer,
+    hash integer,
+    username text,
+    phone text,
+    name text,
+    primary key (session_id, id)
+);
+create table if not exists update_states (
+    session_id text,
+    entity_id integer,
+    pts integer,
+    qts integer,
+    date real,
+    seq integer,
+    primary key (session_id, entity_id)
+);
+"""
+
+
+class StoredSession(MemorySession):
+    """
+    Telethon session held in memory; a SessionStore persists it.
+
+    Entity and update-state changes are only marked dirty here and written
+    in batches by the store, so downloads never wait on disk. A new auth key
+    or DC is written right away, since losing it means signing in again.
+    Entities are indexed by id and username instead of scanned.
+    """
+
+    def __init__(self, store: "SessionStore", session_id: str):
+        super().__init__()
+        self.store = store
+        self.session_id = session_id
+        self._by_id: Dict[int, Tuple] = {}
+        self._by_username: Dict[str, Tuple] = {}
+
+        # Changes not yet written by the store
+        self._auth_dirty = False
+        self._pending_entities: Dict[int, Tuple] = {}
+        self._pending_states: Set[int] = set()
+
+    def _load_entity(self, row: Tuple):
+        old = self._by_id.get(row[0])
+        if old is not None:
+            self._entities.discard(old)
+            if old[2]:
+                self._by_username.pop(old[2], None)
+        self._by_id[row[0]] = row
+        self._entities.add(row)
+        if row[2]:
+            self._by_username[row[2]] = row
+
+    def _auth_changed(self):
+        self._auth_dirty = True
+        self.store.mark_dirty(self, durable=True)
+
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self._auth_changed()
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self._auth_changed()
+
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self._auth_changed()
+
+    def set_update_state(self, entity_id, state):
+        super().set_update_state(entity_id, state)
+        self._pending_states.add(entity_id)
+        self.store.mark_dirty(self)
+
+    def process_entities(self, tlo):
+        changed = False
+        for row in self._entities_to_rows(tlo):
+            if self._by_id.get(row[0]) != row:
+                self._load_entity(row)
+                self._pending_entities[row[0]] = row
+                changed = True
+        if changed:
+            self.store.mark_dirty(self)
+
+    def get_entity_rows_by_username(self, username):
+        row = self._by_username.get(username)
+        return (row[0], row[1]) if row else None
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            ids = (id,)
+        else:
+            ids = (
+                utils.get_peer_id(types.PeerUser(id)),
+                utils.get_peer_id(types.PeerChat(id)),
+                utils.get_peer_id(types.PeerChannel(id))
+            )
+        for peer_id in ids:
+            row = self._by_id.get(peer_id)
+            if row:
+                return row[0], row[1]
+        return None
+
+    def save(self):
+        # Telethon calls this often; writes are batched by the store
+        self.store.mark_dirty(self)
+
+    def delete(self):
+        self.store.delete(self.session_id)
+
+    def take_changes(self) -> Dict:
+        """Snapshot and clear pending changes, for the store to write."""
+        changes = {"session_id": self.session_id, "auth": None, "entities": [], "states": []}
+        if self._auth_dirty:
+            changes["auth"] = (
+                self._dc_id,
+                self._server_address,
+                self._port,
+                self._auth_key.key if self._auth_key else None,
+                self._takeout_id
+            )
+            self._auth_dirty = False
+        changes["entities"] = list(self._pending_entities.values())
+        self._pending_entities = {}
+        for entity_id in self._pending_states:
+            state = self._update_states.get(entity_id)
+            if state is not None:
+                changes["states"].append((entity_id, state.pts, state.qts, state.date.timestamp(), state.seq))
+        self._pending_states = set()
+        return changes
+
+    def restore_changes(self, changes: Dict):
+        """Put back changes whose write failed; newer pending changes win."""
+        if changes["auth"] is not None:
+            self._auth_dirty = True
+        for row in changes["entities"]:
+            self._pending_entities.setdefault(row[0], row)
+        self._pending_states.update(state[0] for state in changes["states"])
+
+
+class SessionStore:
+    """
+    One SQLite database holding every StoredSession.
+
+    Dirty sessions are written together in a single transaction, on a
+    worker thread, every flush interval; auth changes trigger a flush at
+    once. Sessions still in a per-session .session file are imported on
+    first open.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sessions: Dict[str, StoredSession] = {}
+        self.dirty: Set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+        self._flush_task: Optional[asyncio.Task] = None
+        self._durable_pending = False
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def has(self, session_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "select 1 from sessions where session_id = ? and auth_key is not null", (session_id,)
+            ).fetchone()
+        return row is not None
+
+    def open(self, session_id: str, import_path: Optional[str] = None) -> StoredSession:
+        """Load a session, importing it from a .session file the first time."""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            return session
+
+        session = StoredSession(self, session_id)
+        self.sessions[session_id] = session
+        if not self._load(session) and import_path and os.path.exists(import_path):
+            self._import_sqlite(session, import_path)
+        return session
+
+    def _load(self, session: StoredSession) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "select dc_id, server_address, port, auth_key, takeout_id from sessions where session_id = ?",
+                (session.session_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            entities = self._conn.execute(
+                "select id, hash, username, phone, name from entities where session_id = ?",
+                (session.session_id,)
+            ).fetchall()
+            states = self._conn.execute(
+                "select entity_id, pts, qts, date, seq from update_states where session_id = ?",
+                (session.session_id,)
+            ).fetchall()
+
+        self._restore(session, row, entities)
+        for entity_id, pts, qts, date, seq in states:
+            session._update_states[entity_id] = types.updates.State(
+                pts=pts,
+                qts=qts,
+                date=datetime.datetime.fromtimestamp(date, tz=datetime.timezone.utc),
+                seq=seq,
+                unread_count=0
+            )
+        return True
+
+    def _import_sqlite(self, session: StoredSession, path: str):
+        """Copy auth data and entities from Telethon's per-session SQLite file."""
+        try:
+            conn = sqlite3.connect(path)
+            try:
+                row = conn.execute(
+                    "select dc_id, server_address, port, auth_key, takeout_id from sessions"
+                ).fetchone()
+                entities = conn.execute("select id, hash, username, phone, name from entities").fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Could not import session file {path}: {e}")
+            return
+        if row is None:
+            return
+
+        self._restore(session, row, entities)
+        session._auth_dirty = True
+        session._pending_entities = dict(session._by_id)
+        self.mark_dirty(session, durable=True)
+
+    def _restore(self, session: StoredSession, row: Tuple, entities: List[Tuple]):
+        dc_id, server_address, port, auth_key, takeout_id = row
+        session._dc_id = dc_id or 0
+        session._server_address = server_address
+        session._port = port
+        session._auth_key = AuthKey(data=auth_key) if auth_key else None
+        session._takeout_id = takeout_id
+        for entity_id, entity_hash, username, phone, name in entities:
+            # Telethon's own schema stores phone numbers as integers
+            phone = str(phone) if phone is not None else None
+            session._load_entity((entity_id, entity_hash, username, phone, name))
+
+    def mark_dirty(self, session: StoredSession, durable: bool = False):
+        self.dirty.add(session.session_id)
+        if durable:
+            self._flush_soon()
+
+    def _flush_soon(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Outside the event loop (e.g. startup): write synchronously
+            changes = self._take_changes()
+            try:
+                self._write(changes)
+            except Exception as e:
+                # Left to the flusher once the loop runs
+                self._restore_changes(changes)
+                print(f"Session store write failed: {e}")
+            return
+        self._durable_pending = True
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_durable())
+
+    async def _flush_durable(self):
+        """Flush until no auth change is left waiting, retrying failed writes."""
+        while self._durable_pending:
+            self._durable_pending = False
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Session store flush failed: {e}")
+                await asyncio.sleep(DURABLE_RETRY_DELAY)
+
+    def _take_changes(self) -> List[Dict]:
+        changes = []
+        for session_id in self.dirty:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                changes.append(session.take_changes())
+        self.dirty = set()
+        return changes
+
+    def _restore_changes(self, changes: List[Dict]):
+        """Mark changes from a failed write pending again, so a later flush retries them."""
+        for change in changes:
+            session = self.sessions.get(change["session_id"])
+            if session is None:
+                # Deleted meanwhile
+                continue
+            session.restore_changes(change)
+            self.dirty.add(session.session_id)
+            if change["auth"] is not None:
+                self._durable_pending = True
+
+    def _write(self, changes: List[Dict]):
+        """Write a batch of session changes in one transaction (blocking)."""
+        if not changes:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            for change in changes:
+                session_id = change["session_id"]
+                if change["auth"] is not None:
+                    self._conn.execute(
+                        "insert or replace into sessions values (?, ?, ?, ?, ?, ?, ?)",
+                        (session_id, *change["auth"], now)
+                    )
+                self._conn.executemany(
+                    "insert or replace into entities values (?, ?, ?, ?, ?, ?)",
+                    [(session_id, *row) for row in change["entities"]]
+                )
+                self._conn.executemany(
+                    "insert or replace into update_states values (?, ?, ?, ?, ?, ?)",
+                    [(session_id, *state) for state in change["states"]]
+                )
+
+    async def flush(self):
+        """Write all pending changes on the store's worker thread."""
+        changes = self._take_changes()
+        if changes:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(self._executor, self._write, changes)
+            except BaseException:
+                self._restore_changes(changes)
+                raise
+
+    async def run_flusher(self, interval_seconds: float = 5):
+        """Flush pending changes periodically (runs in background)."""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Session store flush failed: {e}")
+
+    def delete(self, session_id: str):
+        """Remove a logged-out session."""
+        self.sessions.pop(session_id, None)
+        self.dirty.discard(session_id)
+        with self._lock, self._conn:
+            for table in ("sessions", "entities", "update_states"):
+                self._conn.execute(f"delete from {table} where session_id = ?", (session_id,))
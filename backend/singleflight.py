@@ -0,0 +1,32 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical operations.
+
+    The first caller for a key starts the work as a task; callers arriving
+    while it runs wait for the same task and get the same result or
+    exception. Waiters are shielded from each other: a cancelled waiter
+    leaves, the shared task keeps running for the rest. The key is dropped
+    once the task finishes, so later calls start fresh work.
+    """
+
+    def __init__(self):
+        self.inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def run(self, key: Hashable, operation: Callable[[], Awaitable]) -> Any:
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(operation())
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        # Every waiter may have been cancelled; don't leave the error unretrieved
+        if not task.cancelled():
+            task.exception()
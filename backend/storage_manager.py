@@ -0,0 +1,311 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+
+# Bookkeeping files that live next to downloaded media and must never be evicted
+RESERVED_FILENAMES = {"last_message_id.txt"}
+
+# Cached stat results used when serving files; entries of tracked files
+# are also dropped whenever the manager records or removes them
+STAT_CACHE_TTL = 30
+STAT_CACHE_SIZE = 10000
+
+
+class StorageQuotaError(ValueError):
+    """Raised when a download cannot fit within the configured quotas."""
+
+
+class StoredFile:
+    __slots__ = ("path", "size", "session_id", "download_id", "last_access", "finished_at", "inode")
+
+    def __init__(
+        self,
+        path: str,
+        size: int,
+        session_id: str,
+        download_id: Optional[str],
+        last_access: float,
+        finished_at: Optional[float],
+        inode: Optional[Tuple[int, int]] = None
+    ):
+        self.path = path
+        self.size = size
+        self.session_id = session_id
+        self.download_id = download_id
+        self.last_access = last_access
+        self.finished_at = finished_at
+        self.inode = inode  # (st_dev, st_ino); hard links of one file share it
+
+
+def _inode(st: os.stat_result) -> Tuple[int, int]:
+    return st.st_dev, st.st_ino
+
+
+class StorageManager:
+    """
+    Tracks disk usage of the downloads directory and keeps it within quotas.
+
+    Usage is maintained incrementally as files are recorded, served and
+    removed; the directory tree is only walked once, by scan(), on startup.
+    Files are kept in least-recently-served order so eviction pops from the
+    front. Files belonging to jobs that are still running are protected.
+    A quota or TTL of 0 disables that limit.
+
+    Hard links of one file (shared media) count once towards the global
+    total, since they take the space once; each session is still charged
+    for the links in its own directory.
+    """
+
+    def __init__(
+        self,
+        downloads_dir: str,
+        global_quota_bytes: int = 0,
+        session_quota_bytes: int = 0,
+        file_ttl_seconds: int = 0
+    ):
+        self.downloads_dir = downloads_dir
+        self.global_quota_bytes = global_quota_bytes
+        self.session_quota_bytes = session_quota_bytes
+        self.file_ttl_seconds = file_ttl_seconds
+
+        self.files: "OrderedDict[str, StoredFile]" = OrderedDict()  # path -> entry, LRU first
+        self.session_usage: Dict[str, int] = {}
+        self.total_usage = 0
+        self.links: Dict[Tuple[int, int], int] = {}  # inode -> tracked paths linking to it
+        self.protected_downloads: Set[str] = set()
+        self.stat_cache: "OrderedDict[str, Tuple[float, os.stat_result]]" = OrderedDict()  # path -> (cached at, stat)
+
+    def scan(self):
+        """Register files already on disk (downloads/<session_id>/<channel_id>/<file>)."""
+        found = []
+        if not os.path.isdir(self.downloads_dir):
+            return
+        for session_id in os.listdir(self.downloads_dir):
+            # Dot directories hold service metadata (e.g. spilled job states)
+            if session_id.startswith("."):
+                continue
+            session_dir = os.path.join(self.downloads_dir, session_id)
+            if not os.path.isdir(session_dir):
+                continue
+            for root, dirnames, filenames in os.walk(session_dir):
+                # Skip scratch directories such as partial prefetches
+                dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+                for filename in filenames:
+                    if filename in RESERVED_FILENAMES:
+                        continue
+                    path = os.path.join(root, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((
+                        max(st.st_atime, st.st_mtime), path, st.st_size, session_id, st.st_mtime, _inode(st)
+                    ))
+
+        # Oldest access first so the OrderedDict starts in LRU order
+        found.sort()
+        for last_access, path, size, session_id, mtime, inode in found:
+            self._add(StoredFile(path, size, session_id, None, last_access, mtime, inode))
+
+    def _add(self, entry: StoredFile):
+        self._discard(entry.path)
+        self.files[entry.path] = entry
+        self.session_usage[entry.session_id] = self.session_usage.get(entry.session_id, 0) + entry.size
+        if entry.inode is None:
+            self.total_usage += entry.size
+        else:
+            count = self.links.get(entry.inode, 0)
+            self.links[entry.inode] = count + 1
+            if not count:
+                self.total_usage += entry.size
+
+    def _discard(self, path: str) -> Optional[StoredFile]:
+        self.stat_cache.pop(path, None)
+        entry = self.files.pop(path, None)
+        if entry is None:
+            return None
+        if entry.inode is None:
+            self.total_usage -= entry.size
+        else:
+            count = self.links.pop(entry.inode, 1) - 1
+            if count:
+                self.links[entry.inode] = count
+            else:
+                self.total_usage -= entry.size
+        remaining = self.session_usage.get(entry.session_id, 0) - entry.size
+        if remaining > 0:
+            self.session_usage[entry.session_id] = remaining
+        else:
+            self.session_usage.pop(entry.session_id, None)
+        return entry
+
+    def _delete(self, entry: StoredFile) -> int:
+        """Remove a tracked file from disk and from the accounting."""
+        self._discard(entry.path)
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+        # A hard link only frees space together with the file's last link
+        return 0 if entry.inode in self.links else entry.size
+
+    def _is_protected(self, entry: StoredFile) -> bool:
+        return entry.download_id is not None and entry.download_id in self.protected_downloads
+
+    def protect(self, download_id: str):
+        """Mark a job as in progress so its files are never evicted."""
+        self.protected_downloads.add(download_id)
+
+    def release(self, download_id: str):
+        """Mark a job as finished; its files start aging towards the TTL."""
+        self.protected_downloads.discard(download_id)
+        now = time.time()
+        for entry in self.files.values():
+            if entry.download_id == download_id:
+                entry.finished_at = now
+
+    def record_file(
+        self,
+        path: str,
+        size: int,
+        session_id: str,
+        download_id: Optional[str] = None
+    ):
+        """Account for a newly written file."""
+        now = time.time()
+        finished_at = None if download_id in self.protected_downloads else now
+        try:
+            inode = _inode(os.stat(path))
+        except OSError:
+            inode = None
+        self._add(StoredFile(path, size, session_id, download_id, now, finished_at, inode))
+
+    def touch(self, path: str):
+        """Mark a file as recently served."""
+        entry = self.files.get(path)
+        if entry is not None:
+            entry.last_access = time.time()
+            self.files.move_to_end(path)
+
+    def forget(self, path: str):
+        """Stop tracking a file that was removed by someone else."""
+        self._discard(path)
+
+    def stat(self, path: str) -> Optional[os.stat_result]:
+        """os.stat for serving a file, cached briefly; None if it is missing."""
+        now = time.monotonic()
+        cached = self.stat_cache.get(path)
+        if cached and now - cached[0] < STAT_CACHE_TTL:
+            self.stat_cache.move_to_end(path)
+            return cached[1]
+        try:
+            result = os.stat(path)
+        except OSError:
+            self.stat_cache.pop(path, None)
+            return None
+        self.stat_cache[path] = (now, result)
+        self.stat_cache.move_to_end(path)
+        while len(self.stat_cache) > STAT_CACHE_SIZE:
+            self.stat_cache.popitem(last=False)
+        return result
+
+    def is_tracked(self, path: str) -> bool:
+        return path in self.files
+
+    def _evict(self, needed: int, session_id: Optional[str] = None) -> int:
+        """
+        Evict least recently served unprotected files until `needed` bytes are freed.
+        Nothing is deleted if the evictable files cannot cover `needed`.
+        For the global total a hard-linked file only frees its size once its
+        last tracked link is evicted.
+        """
+        victims = []
+        freed = 0
+        unlinked: Dict[Tuple[int, int], int] = {}  # inode -> its links among the victims
+        for entry in self.files.values():
+            if freed >= needed:
+                break
+            if session_id is not None and entry.session_id != session_id:
+                continue
+            if self._is_protected(entry):
+                continue
+            victims.append(entry)
+            if session_id is not None or entry.inode is None:
+                freed += entry.size
+                continue
+            unlinked[entry.inode] = unlinked.get(entry.inode, 0) + 1
+            if unlinked[entry.inode] == self.links.get(entry.inode, 1):
+                freed += entry.size
+        if freed < needed:
+            return 0
+        for entry in victims:
+            self._delete(entry)
+        return freed
+
+    def expire(self) -> int:
+        """Delete files of finished jobs that have not been served within the TTL."""
+        if not self.file_ttl_seconds:
+            return 0
+        cutoff = time.time() - self.file_ttl_seconds
+        freed = 0
+        for entry in list(self.files.values()):
+            # Entries are in LRU order, so everything after this was served more recently
+            if entry.last_access >= cutoff:
+                break
+            if self._is_protected(entry) or entry.finished_at is None or entry.finished_at >= cutoff:
+                continue
+            freed += self._delete(entry)
+        return freed
+
+    def ensure_space(self, session_id: str, size: int):
+        """
+        Make room for a file of `size` bytes for a session, evicting if needed.
+        Raises StorageQuotaError when only protected files are left to evict.
+        """
+        if self.session_quota_bytes:
+            if size > self.session_quota_bytes:
+                raise StorageQuotaError("File is larger than the per-session storage quota")
+            overflow = self.session_usage.get(session_id, 0) + size - self.session_quota_bytes
+            if overflow > 0 and self._evict(overflow, session_id) < overflow:
+                raise StorageQuotaError("Per-session storage quota exceeded")
+
+        if self.global_quota_bytes:
+            if size > self.global_quota_bytes:
+                raise StorageQuotaError("File is larger than the global storage quota")
+            overflow = self.total_usage + size - self.global_quota_bytes
+            if overflow > 0 and self._evict(overflow) < overflow:
+                raise StorageQuotaError("Global storage quota exceeded")
+
+    def fits(self, session_id: str, size: int) -> bool:
+        """Check whether a file fits in the free quota without evicting anything."""
+        if self.session_quota_bytes and self.session_usage.get(session_id, 0) + size > self.session_quota_bytes:
+            return False
+        if self.global_quota_bytes and self.total_usage + size > self.global_quota_bytes:
+            return False
+        return True
+
+    def get_usage(self, session_id: Optional[str] = None) -> Dict:
+        """Return current usage figures."""
+        usage = {
+            "total_bytes": self.total_usage,
+            "global_quota_bytes": self.global_quota_bytes,
+            "session_quota_bytes": self.session_quota_bytes,
+            "tracked_files": len(self.files),
+        }
+        if session_id is not None:
+            usage["session_bytes"] = self.session_usage.get(session_id, 0)
+        return usage
+
+    async def run_janitor(self, interval_seconds: int = 300):
+        """Periodically apply the TTL (runs in background)."""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                freed = self.expire()
+                if freed:
+                    print(f"Storage janitor expired {freed} bytes")
+            except Exception as e:
+                print(f"Storage janitor error: {e}")
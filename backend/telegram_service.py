@@ -1,7 +1,9 @@
 import os
+import json
+import time
 import uuid
 import asyncio
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from telethon import TelegramClient
 from telethon.errors import (
     PhoneCodeInvalidError,
@@ -12,22 +14,114 @@ from telethon.errors import (
 )
 from telethon.tl.types import User
 
+from session_store import SESSION_BACKENDS, SessionStore
+
+
+# Concurrent client connections while warming up sessions on startup
+WARMUP_CONCURRENCY = 8
+
+# Minimum seconds between registry writes caused only by session activity
+REGISTRY_SAVE_INTERVAL = 60
+
 
 class TelegramService:
-    def __init__(self, sessions_dir: str = "sessions"):
+    def __init__(self, sessions_dir: str = "sessions", session_backend: str = "sqlite"):
         self.sessions_dir = sessions_dir
         os.makedirs(sessions_dir, exist_ok=True)
         
+        # "memory" keeps Telethon session state in memory, persisted in batches to one shared store
+        if session_backend not in SESSION_BACKENDS:
+            raise ValueError(f"Unknown session backend '{session_backend}'. Use one of: {', '.join(SESSION_BACKENDS)}")
+        self.session_store: Optional[SessionStore] = None
+        if session_backend == "memory":
+            self.session_store = SessionStore(os.path.join(sessions_dir, "sessions.db"))
+        
         # In-memory storage for active clients and pending codes
         self.clients: Dict[str, TelegramClient] = {}
         self.pending_sessions: Dict[str, Dict] = {}  # session_id -> {phone, phone_code_hash, api_id, api_hash}
         self.authenticated_sessions: Dict[str, str] = {}  # token -> session_id
         self.session_credentials: Dict[str, Dict] = {}  # session_id -> {api_id, api_hash}
+        self.last_active: Dict[str, float] = {}  # session_id -> unix time of last use
+        
+        # In-flight connects, so concurrent callers share one attempt
+        self._connecting: Dict[int, asyncio.Future] = {}
         
+        # Signed-in sessions survive restarts via a small registry next to the .session files
+        self.registry_path = os.path.join(sessions_dir, "registry.json")
+        self._registry_saved_at = 0.0
+        self._load_registry()
+    
+    def _load_registry(self):
+        """Restore tokens and credentials of signed-in sessions."""
+        if not os.path.exists(self.registry_path):
+            return
+        try:
+            with open(self.registry_path, 'r') as f:
+                registry = json.load(f)
+        except (ValueError, IOError) as e:
+            print(f"Could not read session registry: {e}")
+            return
+        
+        for session_id, entry in registry.items():
+            if not self._session_exists(session_id):
+                continue
+            self.session_credentials[session_id] = {
+                "api_id": entry["api_id"],
+                "api_hash": entry["api_hash"]
+            }
+            self.last_active[session_id] = entry.get("last_active", 0.0)
+            for token in entry.get("tokens", []):
+                self.authenticated_sessions[token] = session_id
+    
+    def _save_registry(self):
+        """Persist tokens and credentials of signed-in sessions."""
+        registry: Dict[str, Dict] = {}
+        for token, session_id in self.authenticated_sessions.items():
+            creds = self.session_credentials.get(session_id)
+            if not creds:
+                continue
+            entry = registry.setdefault(session_id, {
+                "api_id": creds["api_id"],
+                "api_hash": creds["api_hash"],
+                "last_active": self.last_active.get(session_id, 0.0),
+                "tokens": []
+            })
+            entry["tokens"].append(token)
+        
+        try:
+            tmp_path = self.registry_path + ".tmp"
+            # Holds bearer tokens and api_hash: readable by the owner only
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(registry, f)
+            os.replace(tmp_path, self.registry_path)
+            self._registry_saved_at = time.time()
+        except IOError as e:
+            print(f"Could not save session registry: {e}")
+    
+    def _touch_session(self, session_id: str):
+        """Record session activity; persisted at most every REGISTRY_SAVE_INTERVAL."""
+        now = time.time()
+        self.last_active[session_id] = now
+        if now - self._registry_saved_at > REGISTRY_SAVE_INTERVAL:
+            self._save_registry()
+    
     def _get_session_path(self, session_id: str) -> str:
         """Get the session file path for a given session ID."""
         return os.path.join(self.sessions_dir, f"{session_id}.session")
     
+    def _session_exists(self, session_id: str) -> bool:
+        if self.session_store is not None and self.session_store.has(session_id):
+            return True
+        return os.path.exists(self._get_session_path(session_id))
+    
+    def _open_session(self, session_id: str):
+        """Session for a new TelegramClient: a .session file path, or a session from the shared store."""
+        session_path = self._get_session_path(session_id)
+        if self.session_store is None:
+            return session_path
+        return self.session_store.open(session_id, import_path=session_path)
+    
     async def send_code(self, phone: str, api_id: int, api_hash: str) -> Dict:
         """
         Send OTP code to the phone number.
@@ -35,7 +129,6 @@ class TelegramService:
         """
         try:
             session_id = str(uuid.uuid4())
-            session_path = self._get_session_path(session_id)
             
             # Store API credentials for this session
             self.session_credentials[session_id] = {
@@ -44,7 +137,7 @@ class TelegramService:
             }
             
             # Create a new client for this session with user-provided credentials
-            client = TelegramClient(session_path, api_id, api_hash)
+            client = TelegramClient(self._open_session(session_id), api_id, api_hash)
             await client.connect()
             
             if not await client.is_user_authorized():
@@ -74,6 +167,8 @@ class TelegramService:
                 await client.disconnect()
                 token = str(uuid.uuid4())
                 self.authenticated_sessions[token] = session_id
+                self.last_active[session_id] = time.time()
+                self._save_registry()
                 return {
                     "session_id": session_id,
                     "status": "already_authorized",
@@ -135,6 +230,9 @@ class TelegramService:
             # Remove from pending
             del self.pending_sessions[session_id]
             
+            self.last_active[session_id] = time.time()
+            self._save_registry()
+            
             return {
                 "token": token,
                 "user_info": user_info,
@@ -154,22 +252,68 @@ class TelegramService:
             return None
         
         session_id = self.authenticated_sessions[token]
+        self._touch_session(session_id)
+        return self._get_or_create_client(session_id)
+    
+    def _get_or_create_client(self, session_id: str) -> Optional[TelegramClient]:
+        """Get the client for a session, building it from stored credentials if needed."""
         if session_id not in self.clients:
             # Reconnect client with stored credentials
-            session_path = self._get_session_path(session_id)
             if session_id not in self.session_credentials:
                 return None
             creds = self.session_credentials[session_id]
-            client = TelegramClient(session_path, creds["api_id"], creds["api_hash"])
+            client = TelegramClient(self._open_session(session_id), creds["api_id"], creds["api_hash"])
             self.clients[session_id] = client
         
         return self.clients[session_id]
     
+    async def _connect(self, client: TelegramClient):
+        """Connect a client, sharing one attempt between concurrent callers."""
+        if client.is_connected():
+            return
+        key = id(client)
+        future = self._connecting.get(key)
+        if future is None:
+            future = asyncio.ensure_future(client.connect())
+            self._connecting[key] = future
+            future.add_done_callback(lambda _: self._connecting.pop(key, None))
+        await asyncio.shield(future)
+    
     async def ensure_connected(self, client: TelegramClient):
         """Ensure client is connected and authorized."""
-        if not client.is_connected():
-            await client.connect()
+        await self._connect(client)
         
         if not await client.is_user_authorized():
             raise ValueError("Session expired. Please re-authenticate")
+    
+    def recent_sessions(self, limit: int) -> List[str]:
+        """Signed-in sessions, most recently active first."""
+        session_ids = set(self.authenticated_sessions.values())
+        ordered = sorted(session_ids, key=lambda s: self.last_active.get(s, 0.0), reverse=True)
+        return ordered[:limit]
+    
+    async def warm_up(self, limit: int):
+        """
+        Connect the most recently active sessions concurrently (runs in background),
+        so their first request does not pay for client construction, connect
+        and the authorization check.
+        """
+        semaphore = asyncio.Semaphore(WARMUP_CONCURRENCY)
+        
+        async def warm(session_id: str):
+            async with semaphore:
+                try:
+                    client = self._get_or_create_client(session_id)
+                    if client:
+                        await self._connect(client)
+                        # Telethon caches the answer on the client
+                        await client.is_user_authorized()
+                except Exception as e:
+                    print(f"Warm-up of session {session_id} failed: {e}")
+        
+        started = time.perf_counter()
+        session_ids = self.recent_sessions(limit)
+        await asyncio.gather(*(warm(session_id) for session_id in session_ids))
+        if session_ids:
+            print(f"Warmed up {len(session_ids)} sessions in {time.perf_counter() - started:.2f}s")
 
@@ -0,0 +1,80 @@
+import asyncio
+import datetime
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import Document, DocumentAttributeFilename, MessageMediaDocument
+
+import download_service
+from download_service import DownloadService
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, flood_waits: int = 0):
+        self.id = message_id
+        self.date = datetime.datetime(2026, 1, 1)
+        self.data = f"file {message_id}".encode()
+        self.media = MessageMediaDocument(document=Document(
+            id=1000 + message_id,
+            access_hash=1,
+            file_reference=b"",
+            date=self.date,
+            mime_type="application/octet-stream",
+            size=len(self.data),
+            dc_id=2,
+            attributes=[DocumentAttributeFilename(f"{message_id}.bin")]
+        ))
+        self.flood_waits = flood_waits
+
+    @property
+    def file(self):
+        from telethon.tl.custom.file import File
+        return File(self.media.document)
+
+    async def download_media(self, file, progress_callback=None):
+        if self.flood_waits:
+            self.flood_waits -= 1
+            raise FloodWaitError(None, capture=0)
+        file.write(self.data)
+        if progress_callback:
+            await progress_callback(len(self.data), len(self.data))
+        return file
+
+
+class FakeClient:
+    def __init__(self, messages):
+        self.messages = messages
+        self.disconnected = asyncio.get_running_loop().create_future()
+
+    def is_connected(self):
+        return True
+
+    def add_event_handler(self, *args):
+        pass
+
+    def remove_event_handler(self, *args):
+        pass
+
+    async def iter_messages(self, channel_id, min_id=0, reverse=False):
+        for message in self.messages:
+            if message.id > min_id:
+                yield message
+
+
+def test_flood_wait_does_not_skip_message(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_service, "WATCH_RECONNECT_DELAY", 0)
+
+    async def run():
+        service = DownloadService(str(tmp_path))
+        client = FakeClient([FakeMessage(1), FakeMessage(2, flood_waits=1), FakeMessage(3)])
+        download_id = await service.start_watch(client, 5, "session")
+        for _ in range(100):
+            state = service.get_download_status(download_id)
+            if state.last_message_id == 3:
+                break
+            await asyncio.sleep(0.01)
+        await service.stop_watch(download_id)
+        return service.get_download_status(download_id)
+
+    state = asyncio.run(run())
+    assert state.last_message_id == 3
+    assert sorted(entry["filename"] for entry in state.files) == ["1.bin", "2.bin", "3.bin"]
@@ -0,0 +1,104 @@
+import os
+from collections import OrderedDict
+from typing import Optional
+
+
+class ThumbnailCache:
+    """
+    Two-level LRU cache of thumbnail JPEG bytes keyed by media id.
+
+    The memory level holds the hottest previews; the disk level survives
+    restarts. Both are bounded by total bytes, and the disk level is
+    indexed in memory so lookups never walk the directory.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = "thumbnails",
+        memory_limit_bytes: int = 32 * 1024 * 1024,
+        disk_limit_bytes: int = 512 * 1024 * 1024
+    ):
+        self.cache_dir = cache_dir
+        self.memory_limit_bytes = memory_limit_bytes
+        self.disk_limit_bytes = disk_limit_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self.memory_usage = 0
+        self.disk: "OrderedDict[str, int]" = OrderedDict()  # key -> size, LRU first
+        self.disk_usage = 0
+        self._load_disk_index()
+
+    def _load_disk_index(self):
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".jpg"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, filename))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, filename[:-4], st.st_size))
+        entries.sort()
+        for _, key, size in entries:
+            self.disk[key] = size
+            self.disk_usage += size
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.jpg")
+
+    def _remember(self, key: str, data: bytes):
+        """Put bytes in the memory level, evicting least recently used entries."""
+        if len(data) > self.memory_limit_bytes:
+            return
+        old = self.memory.pop(key, None)
+        if old is not None:
+            self.memory_usage -= len(old)
+        self.memory[key] = data
+        self.memory_usage += len(data)
+        while self.memory_usage > self.memory_limit_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_usage -= len(evicted)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return cached thumbnail bytes, or None on a miss."""
+        data = self.memory.get(key)
+        if data is not None:
+            self.memory.move_to_end(key)
+            return data
+
+        if key not in self.disk:
+            return None
+        try:
+            with open(self._get_path(key), 'rb') as f:
+                data = f.read()
+        except IOError:
+            self.disk_usage -= self.disk.pop(key)
+            return None
+        self.disk.move_to_end(key)
+        self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Store thumbnail bytes in both levels."""
+        self._remember(key, data)
+        if len(data) > self.disk_limit_bytes:
+            return
+
+        try:
+            with open(self._get_path(key), 'wb') as f:
+                f.write(data)
+        except IOError as e:
+            print(f"Error caching thumbnail {key}: {e}")
+            return
+        self.disk_usage -= self.disk.pop(key, 0)
+        self.disk[key] = len(data)
+        self.disk_usage += len(data)
+
+        while self.disk_usage > self.disk_limit_bytes:
+            evicted, size = self.disk.popitem(last=False)
+            self.disk_usage -= size
+            try:
+                os.remove(self._get_path(evicted))
+            except OSError:
+                pass
@@ -16,6 +16,7 @@ export default function DownloadProgress({ status, token }: DownloadProgressProp
       case "failed":
         return "bg-red-500";
       case "in_progress":
+      case "watching":
         return "bg-blue-500";
       default:
         return "bg-gray-500";
@@ -30,6 +31,8 @@ export default function DownloadProgress({ status, token }: DownloadProgressProp
         return "Failed";
       case "in_progress":
         return "In Progress";
+      case "watching":
+        return "Watching";
       default:
         return "Pending";
     }
@@ -10,6 +10,8 @@ import {
   ListChannelFilesResponse,
   DownloadAllRequest,
   DownloadAllResponse,
+  PreviewBatchRequest,
+  PreviewBatchResponse,
 } from "./types";
 
 // Get API URL from environment variable, fallback to localhost for development
@@ -64,9 +66,11 @@ export async function startDownload(
 
 export async function getDownloadStatus(
   downloadId: string,
-  token: string
+  token: string,
+  since = 0
 ): Promise<DownloadStatusResponse> {
-  return fetchAPI<DownloadStatusResponse>(`/api/download/status/${downloadId}`, {
+  // Only files completed after `since` are returned; pass the previous response's cursor
+  return fetchAPI<DownloadStatusResponse>(`/api/download/status/${downloadId}?since=${since}`, {
     headers: {
       Authorization: `Bearer ${token}`,
     },
@@ -167,3 +171,16 @@ export async function downloadAllFiles(
   });
 }
 
+
+export async function getFilePreviews(
+  data: PreviewBatchRequest,
+  token: string
+): Promise<PreviewBatchResponse> {
+  return fetchAPI<PreviewBatchResponse>("/api/file/previews", {
+    method: "POST",
+    headers: {
+      Authorization: `Bearer ${token}`,
+    },
+    body: JSON.stringify(data),
+  });
+}
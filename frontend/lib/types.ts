@@ -31,6 +31,9 @@ export interface VerifyCodeResponse {
 
 export interface StartDownloadRequest {
   channel: string;
+  watch?: boolean;
+  shard_tokens?: string[]; // Other signed-in accounts to share the download with
+  post_process?: string[]; // e.g. ["extract_archive", "metadata"]
 }
 
 export interface StartDownloadResponse {
@@ -39,13 +42,20 @@ export interface StartDownloadResponse {
   message: string;
 }
 
-export type DownloadStatus = "pending" | "in_progress" | "completed" | "failed";
+export type DownloadStatus = "pending" | "in_progress" | "completed" | "failed" | "watching";
 
 export interface FileInfo {
   filename: string;
   size: number;
   path: string;
-  download_url: string;
+  download_url: string | null;
+  sha256?: string;
+  evicted?: boolean;
+  post_process?: {
+    status: "pending" | "completed" | "failed";
+    steps?: Record<string, { outputs?: string[]; metadata?: Record<string, unknown>; error?: string }>;
+    error?: string;
+  } | null;
 }
 
 export interface DownloadStatusResponse {
@@ -55,8 +65,14 @@ export interface DownloadStatusResponse {
   total_files: number;
   downloaded_files: number;
   files: FileInfo[];
+  cursor: number;
   current_file?: string;
   error?: string;
+  bandwidth?: {
+    global_limit: number; // bytes/s, 0 = unlimited
+    session_limit: number;
+    session_rate: number; // current download rate of this session
+  };
 }
 
 export interface ChannelFileInfo {
@@ -94,8 +110,19 @@ export interface DownloadAllResponse {
     filename: string | null;
     size: number;
     path: string | null;
+    sha256?: string | null;
     success: boolean;
     error?: string;
   }>;
 }
 
+
+export interface PreviewBatchRequest {
+  channel: string;
+  message_ids: number[]; // At most 100 per request
+}
+
+export interface PreviewBatchResponse {
+  mime_type: string;
+  previews: Record<string, string | null>; // message_id -> base64 image data
+}